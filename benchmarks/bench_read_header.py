@@ -0,0 +1,58 @@
+"""
+Benchmark of RHD header parsing across a directory of .rhd files.
+
+Compares read_header using the single read qstring decoder against the former
+one character at a time decoder. Usage:
+
+python benchmarks/bench_read_header.py /path/to/session_dir [n_repeats]
+"""
+from jaeger_lab_to_nwb.resources.load_intan import read_header as read_header_module
+from jaeger_lab_to_nwb.resources.load_intan.qstring import read_qstring
+
+from pathlib import Path
+import struct
+import time
+import sys
+import os
+
+
+def read_qstring_per_char(fid):
+    """Former read_qstring: one fstat per string and one struct.unpack per character."""
+    length, = struct.unpack('<I', fid.read(4))
+    if length == int('ffffffff', 16): return ""
+    if length > (os.fstat(fid.fileno()).st_size - fid.tell() + 1):
+        raise Exception('Length too long.')
+    data = []
+    for i in range(0, int(length / 2)):
+        c, = struct.unpack('<H', fid.read(2))
+        data.append(c)
+    return ''.join([chr(c) for c in data])
+
+
+def time_headers(files, qstring_reader, n_repeats):
+    """Best of n_repeats wall time to parse the headers of all files."""
+    read_header_module.read_qstring = qstring_reader
+    best = float('inf')
+    for _ in range(n_repeats):
+        t0 = time.perf_counter()
+        for fpath in files:
+            with open(fpath, 'rb') as fid:
+                read_header_module.read_header(fid)
+        best = min(best, time.perf_counter() - t0)
+    read_header_module.read_qstring = read_qstring
+    return best
+
+
+if __name__ == '__main__':
+    source_dir = Path(sys.argv[1])
+    n_repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    files = sorted(source_dir.glob('*.rhd'))
+    if len(files) == 0:
+        raise Exception('No .rhd files found in: ' + str(source_dir))
+
+    t_per_char = time_headers(files, read_qstring_per_char, n_repeats)
+    t_single_read = time_headers(files, read_qstring, n_repeats)
+    print('Parsed {} headers, best of {} repeats'.format(len(files), n_repeats))
+    print('per character read_qstring: {:.4f} s ({:.3f} ms/file)'.format(t_per_char, 1e3 * t_per_char / len(files)))
+    print('single read read_qstring:   {:.4f} s ({:.3f} ms/file)'.format(t_single_read, 1e3 * t_single_read / len(files)))
+    print('speedup: {:.1f}x'.format(t_per_char / t_single_read))
@@ -0,0 +1,82 @@
+"""
+Benchmark of NWB write throughput and file size for HDF5 compression settings.
+
+Converts a session of .rhd files (ecephys) or .rsd/.rsh files (ophys) once per
+setting and reports wall time, throughput of the written ecephys/ophys data and
+file size. Usage:
+
+python benchmarks/bench_write_compression.py {rhd,rsd} /path/to/session_dir /path/to/metafile.yml [output_dir]
+"""
+from jaeger_lab_to_nwb.conversion_module import conversion_function
+
+from pathlib import Path
+import tempfile
+import time
+import h5py
+import yaml
+import sys
+import os
+
+# Settings: name, compression, compression_opts, shuffle
+SETTINGS = [
+    ('none', 'none', None, False),
+    ('lzf', 'lzf', None, False),
+    ('lzf + shuffle', 'lzf', None, True),
+    ('gzip 1 + shuffle', 'gzip', 1, True),
+    ('gzip 4', 'gzip', 4, False),
+    ('gzip 4 + shuffle', 'gzip', 4, True),
+    ('gzip 9 + shuffle', 'gzip', 9, True),
+]
+
+
+def data_nbytes(f_nwb):
+    """Uncompressed bytes of the ElectricalSeries and FRETSeries data in a NWB file."""
+    nbytes = [0]
+
+    def visit(name, obj):
+        if isinstance(obj, h5py.Dataset) and name.endswith('/data') and \
+                obj.parent.attrs.get('neurodata_type') in ['ElectricalSeries', 'FRETSeries']:
+            nbytes[0] += obj.size * obj.dtype.itemsize
+
+    with h5py.File(f_nwb, 'r') as f:
+        f.visititems(visit)
+    return nbytes[0]
+
+
+if __name__ == '__main__':
+    source_type = sys.argv[1]
+    source_dir = sys.argv[2]
+    with open(sys.argv[3]) as f:
+        metadata = yaml.safe_load(f)
+    output_dir = Path(sys.argv[4]) if len(sys.argv) > 4 else Path(tempfile.mkdtemp())
+
+    if source_type == 'rhd':
+        source_paths = {'dir_ecephys_rhd': {'type': 'dir', 'path': source_dir}}
+        kwargs = {'add_rhd': True}
+    elif source_type == 'rsd':
+        source_paths = {'dir_cortical_imaging': {'type': 'dir', 'path': source_dir}}
+        kwargs = {'add_ophys': True}
+    else:
+        raise Exception('Source type should be rhd or rsd, got: ' + source_type)
+
+    results = []
+    for name, compression, compression_opts, shuffle in SETTINGS:
+        f_nwb = output_dir / ('bench_' + name.replace(' ', '').replace('+', '_') + '.nwb')
+        t0 = time.perf_counter()
+        conversion_function(
+            source_paths=source_paths,
+            f_nwb=str(f_nwb),
+            metadata=metadata,
+            compression=compression,
+            compression_opts=compression_opts,
+            shuffle=shuffle,
+            **kwargs
+        )
+        elapsed = time.perf_counter() - t0
+        results.append((name, elapsed, data_nbytes(f_nwb), os.stat(f_nwb).st_size))
+        os.remove(f_nwb)
+
+    print('{:<18} {:>10} {:>12} {:>12} {:>8}'.format('setting', 'time (s)', 'data MB/s', 'file MB', 'ratio'))
+    for name, elapsed, nbytes, size in results:
+        print('{:<18} {:>10.2f} {:>12.1f} {:>12.2f} {:>8.2f}'.format(
+            name, elapsed, nbytes / 1e6 / elapsed, size / 1e6, nbytes / size))
@@ -0,0 +1,363 @@
+# Batch conversion of many sessions, in a process pool
+# written for Jaeger Lab
+# ------------------------------------------------------------------------------
+from jaeger_lab_to_nwb.conversion_module import conversion_function
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+import pandas as pd
+import time
+import yaml
+import csv
+import os
+
+# Source paths of a session in the manifest, with the modality they add
+SOURCE_PATHS = {
+    'file_behavior_bpod': ('file', 'add_bpod'),
+    'dir_behavior_treadmill': ('dir', 'add_treadmill'),
+    'dir_ecephys_rhd': ('dir', 'add_rhd'),
+    'file_electrodes': ('file', None),
+    'dir_behavior_labview': ('dir', 'add_labview'),
+    'dir_cortical_imaging': ('dir', 'add_ophys'),
+}
+
+RESULTS_COLUMNS = ['output_file', 'status', 'duration', 'bytes_written', 'error']
+
+
+def read_manifest(manifest_file):
+    """
+    Reads a manifest of sessions from a .csv or .yml file.
+
+    Each session has an 'output_file', its source paths (see SOURCE_PATHS) and,
+    optionally, a 'metafile' and add_* flags. A YAML manifest is a list of sessions,
+    or a dictionary with a 'sessions' list.
+
+    Returns
+    -------
+    list
+        One dictionary per session, without empty entries.
+    """
+    if str(manifest_file).endswith(('.yml', '.yaml')):
+        with open(manifest_file) as f:
+            sessions = yaml.safe_load(f)
+        if isinstance(sessions, dict):
+            sessions = sessions['sessions']
+    else:
+        sessions = pd.read_csv(manifest_file, dtype=str, keep_default_na=False).to_dict('records')
+
+    sessions = [{k: v for k, v in session.items() if v is not None and v != ''} for session in sessions]
+    for ii, session in enumerate(sessions):
+        if 'output_file' not in session:
+            raise Exception('Session ' + str(ii) + ' of manifest has no output_file: ' + str(manifest_file))
+    return sessions
+
+
+def parse_flag(value):
+    """Boolean manifest flag, from a bool or a 'true'/'false'/'1'/'0' string."""
+    if isinstance(value, str):
+        return value.strip().lower() in ['true', '1', 'yes']
+    return bool(value)
+
+
+def make_job(session, metadata, conversion_kwargs):
+    """
+    Keyword arguments of conversion_function for a session. Modalities are added for
+    all source paths of the session, unless its add_* flags are given.
+    """
+    source_paths = dict()
+    kwargs = dict(conversion_kwargs)
+    for key, (path_type, add_flag) in SOURCE_PATHS.items():
+        if key in session:
+            source_paths[key] = {'type': path_type, 'path': session[key]}
+            if add_flag is not None:
+                kwargs[add_flag] = True
+    for key in ['add_bpod', 'add_treadmill', 'add_rhd', 'add_labview', 'add_ophys']:
+        if key in session:
+            kwargs[key] = parse_flag(session[key])
+    kwargs.update(source_paths=source_paths, f_nwb=session['output_file'], metadata=metadata)
+    return kwargs
+
+
+def data_segment_size():
+    """Current data segment size (VmData) of this process, in bytes, 0 where it is unknown."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmData:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+def limit_memory(memory_limit):
+    """
+    Limits the memory that the current (worker) process may allocate to memory_limit MB
+    on top of its current footprint, where supported. Allocations beyond the limit raise
+    MemoryError.
+
+    RLIMIT_DATA applies to the whole process, not to a single job: memory a worker
+    still holds from earlier jobs (e.g. a fragmented heap) is part of the footprint the
+    limit is added to. Only the soft limit is set, so that it can be restored.
+
+    Returns
+    -------
+    tuple
+        Previous (soft, hard) limits, for restore_memory, or None if memory is not limited.
+    """
+    if memory_limit is None:
+        return None
+    try:
+        import resource
+    except ImportError:
+        print('Memory limits are not supported on this platform.')
+        return None
+    previous = resource.getrlimit(resource.RLIMIT_DATA)
+    nbytes = data_segment_size() + int(memory_limit * 2 ** 20)
+    if previous[1] != resource.RLIM_INFINITY:
+        nbytes = min(nbytes, previous[1])
+    resource.setrlimit(resource.RLIMIT_DATA, (nbytes, previous[1]))
+    return previous
+
+
+def restore_memory(previous):
+    """Restores the memory limits returned by limit_memory."""
+    if previous is None:
+        return
+    import resource
+    resource.setrlimit(resource.RLIMIT_DATA, previous)
+
+
+def convert_session(job, memory_limit=None):
+    """
+    Converts one session in a worker process. The output is written to a temporary
+    file and renamed once complete, so that an existing output file is always complete.
+
+    Workers are reused across sessions. With a memory_limit (MB), the worker memory
+    is limited for the duration of this session only, see limit_memory.
+
+    Returns
+    -------
+    dict
+        Results table row of the session.
+    """
+    f_nwb = job['f_nwb']
+    f_partial = str(Path(f_nwb).with_suffix('.part' + Path(f_nwb).suffix))
+    t0 = time.perf_counter()
+    previous_limits = limit_memory(memory_limit)
+    try:
+        conversion_function(**dict(job, f_nwb=f_partial))
+        os.replace(f_partial, f_nwb)
+        status, error = 'done', ''
+    except Exception as e:
+        status, error = 'failed', '{}: {}'.format(type(e).__name__, e)
+        if os.path.exists(f_partial):
+            os.remove(f_partial)
+    finally:
+        restore_memory(previous_limits)
+    return {
+        'output_file': f_nwb,
+        'status': status,
+        'duration': time.perf_counter() - t0,
+        'bytes_written': os.stat(f_nwb).st_size if status == 'done' else 0,
+        'error': error,
+    }
+
+
+def append_result(results_file, row):
+    """Appends a row to the results table, writing its header if the file is new."""
+    new_file = not os.path.exists(results_file)
+    with open(results_file, 'a', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=RESULTS_COLUMNS)
+        if new_file:
+            writer.writeheader()
+        writer.writerow(row)
+
+
+def batch_conversion(manifest_file, metafile=None, results_file='conversion_results.csv', n_jobs=1,
+                     memory_limit=None, **conversion_kwargs):
+    """
+    Converts all sessions of a manifest, in a pool of n_jobs worker processes.
+
+    Sessions whose output file already exists are skipped, so that an interrupted batch
+    resumes where it stopped. Each converted session adds a row to results_file, with its
+    status ('done' or 'failed'), duration (s), bytes written and error, if any. Skipped
+    sessions are only in the returned rows, with status 'skipped'.
+
+    Parameters
+    ----------
+    manifest_file : str
+        Path to the manifest .csv or .yml file, see read_manifest.
+    metafile : str
+        Path to the metadata YAML file of sessions without a 'metafile' in the manifest.
+    results_file : str
+        Path to the results .csv table, appended to.
+    n_jobs : int
+        Number of sessions converted in parallel, each in its own worker process.
+    memory_limit : float
+        Memory each session may allocate, in MB, on top of the footprint of its worker
+        process when the session starts. Workers are reused across sessions, and the limit
+        (RLIMIT_DATA) applies to the whole worker process, so memory it still holds from
+        earlier sessions is part of that footprint. Sessions exceeding it fail with a
+        MemoryError. If None, memory is not limited.
+    **conversion_kwargs : key, value pairs
+        Keyword arguments of conversion_function shared by all sessions, e.g. compression.
+
+    Returns
+    -------
+    list
+        Results table rows of all sessions.
+    """
+    sessions = read_manifest(manifest_file)
+
+    # Metadata files are loaded once, and shared by their sessions
+    metadata = dict()
+    jobs = []
+    results = []
+    for session in sessions:
+        session_metafile = session.get('metafile', metafile)
+        if session_metafile is None:
+            raise Exception('No metafile given for session: ' + session['output_file'])
+        if session_metafile not in metadata:
+            with open(session_metafile) as f:
+                metadata[session_metafile] = yaml.safe_load(f)
+        if os.path.exists(session['output_file']):
+            # Already in results_file from the run that converted it
+            results.append({'output_file': session['output_file'], 'status': 'skipped', 'duration': 0.,
+                            'bytes_written': 0, 'error': ''})
+            continue
+        Path(session['output_file']).parent.mkdir(parents=True, exist_ok=True)
+        jobs.append(make_job(session, metadata[session_metafile], conversion_kwargs))
+
+    print('Converting {} sessions, {} already complete.'.format(len(jobs), len(results)))
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        futures = {executor.submit(convert_session, job, memory_limit): job for job in jobs}
+        for future in as_completed(futures):
+            try:
+                row = future.result()
+            except BrokenProcessPool:
+                # A worker died (e.g. killed by the system), sessions left in the pool fail
+                row = {'output_file': futures[future]['f_nwb'], 'status': 'failed', 'duration': 0.,
+                       'bytes_written': 0, 'error': 'Worker process terminated abruptly'}
+            append_result(results_file, row)
+            results.append(row)
+            print('{}: {} ({:.1f} s)'.format(row['output_file'], row['status'], row['duration']))
+
+    return results
+
+
+def main():
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(
+        description='convert many sessions to NWB, from a manifest of source paths and output files',
+    )
+
+    # Positional arguments
+    parser.add_argument(
+        "manifest",
+        help="The path to the manifest (.csv or .yml) of sessions: output_file, source paths "
+             "and, optionally, metafile and add_* flags.",
+    )
+    parser.add_argument(
+        "metafile",
+        nargs='?',
+        default=None,
+        help="The path to the metadata YAML file of sessions without a metafile in the manifest.",
+    )
+
+    # Batch arguments
+    parser.add_argument(
+        "--results",
+        default='conversion_results.csv',
+        help="The path to the results table (.csv) of conversions.",
+    )
+    parser.add_argument(
+        "--n_jobs",
+        type=int,
+        default=1,
+        help="Number of sessions converted in parallel.",
+    )
+    parser.add_argument(
+        "--memory_limit",
+        type=float,
+        default=None,
+        help="Memory each session conversion may allocate, in MB.",
+    )
+
+    # Conversion arguments, shared by all sessions
+    parser.add_argument(
+        "--native_dtypes",
+        action="store_true",
+        default=False,
+        help="Whether to keep ecephys data in its native int16 width or not",
+    )
+    parser.add_argument(
+        "--segment_mode",
+        default=None,
+        choices=['timestamps', 'series'],
+        help="How the timing of valid ecephys segments is stored.",
+    )
+    parser.add_argument(
+        "--min_segment_samples",
+        type=int,
+        default=None,
+        help="Minimum length of ecephys segments written as series (default: one second).",
+    )
+    parser.add_argument(
+        "--apply_notch",
+        action="store_true",
+        default=False,
+        help="Whether to apply the notch filter set during the recording to ecephys data or not",
+    )
+    parser.add_argument(
+        "--compression",
+        default=None,
+        choices=['gzip', 'lzf', 'none'],
+        help="HDF5 compression of ecephys and ophys data.",
+    )
+    parser.add_argument(
+        "--compression_opts",
+        type=int,
+        default=None,
+        help="gzip compression level (0-9).",
+    )
+    parser.add_argument(
+        "--no_shuffle",
+        action="store_true",
+        default=False,
+        help="Whether to disable the HDF5 shuffle filter or not",
+    )
+    parser.add_argument(
+        "--cache_tables",
+        action="store_true",
+        default=False,
+        help="Whether to cache parsed behavior tables next to the source files or not",
+    )
+
+    if not sys.argv[1:]:
+        args = parser.parse_args(["--help"])
+    else:
+        args = parser.parse_args()
+
+    batch_conversion(
+        manifest_file=args.manifest,
+        metafile=args.metafile,
+        results_file=args.results,
+        n_jobs=args.n_jobs,
+        memory_limit=args.memory_limit,
+        native_dtypes=args.native_dtypes,
+        segment_mode=args.segment_mode,
+        min_segment_samples=args.min_segment_samples,
+        apply_notch=args.apply_notch,
+        compression=args.compression,
+        compression_opts=args.compression_opts,
+        shuffle=False if args.no_shuffle else None,
+        cache_tables=args.cache_tables,
+    )
+
+
+# If called directly fom terminal
+if __name__ == '__main__':
+    main()
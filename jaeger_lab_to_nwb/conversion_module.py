@@ -2,19 +2,29 @@
 # written for Jaeger Lab
 # ------------------------------------------------------------------------------
 from pynwb import NWBHDF5IO
-from jaeger_lab_to_nwb.resources.add_behavior import (add_behavior_bpod, add_behavior_treadmill,
-                                                      add_behavior_labview)
-from jaeger_lab_to_nwb.resources.add_ecephys import add_ecephys_rhd
-from jaeger_lab_to_nwb.resources.add_ophys import add_ophys_rsd
+from jaeger_lab_to_nwb.resources.add_behavior import (parse_behavior_bpod, attach_behavior_bpod,
+                                                      parse_behavior_treadmill, attach_behavior_treadmill,
+                                                      parse_behavior_labview, attach_behavior_labview)
+from jaeger_lab_to_nwb.resources.add_ecephys import parse_ecephys_rhd, attach_ecephys_rhd
+from jaeger_lab_to_nwb.resources.add_ophys import parse_ophys_rsd, attach_ophys_rsd
+from jaeger_lab_to_nwb.resources.parallel import parse_concurrently
+from jaeger_lab_to_nwb.resources.data_io import data_io_settings
 import yaml
 import os
 
 
 def conversion_function(source_paths, f_nwb, metadata, add_bpod=False, add_treadmill=False,
-                        add_rhd=False, add_labview=False, add_ophys=False, **kwargs):
+                        add_rhd=False, add_labview=False, add_ophys=False, native_dtypes=False,
+                        n_workers=0, max_prefetch=None, segment_mode=None, min_segment_samples=None,
+                        apply_notch=False,
+                        compression=None, compression_opts=None, shuffle=None, append=False, cache_tables=False,
+                        **kwargs):
     """
     Convert data from a diversity of experiment types to nwb.
 
+    Source files of all selected modalities are parsed concurrently, then their data
+    is attached to the nwbfile in order: bpod, rhd, treadmill, labview, ophys.
+
     Parameters
     ----------
     source_paths : dict
@@ -31,6 +41,36 @@ def conversion_function(source_paths, f_nwb, metadata, add_bpod=False, add_tread
         Path to output NWB file, e.g. 'my_file.nwb'.
     metadata : dict
         Metadata dictionary
+    native_dtypes : bool
+        Keep native data widths for ecephys data (int16 samples instead of int32).
+    n_workers : int
+        Number of worker processes decoding source files in parallel. If 0, files are
+        decoded in the main process. LabView files are read by as many threads.
+    max_prefetch : int
+        Maximum number of decoded source files (ecephys) or trials (ophys) held in
+        memory. Defaults to n_workers.
+    segment_mode : str
+        How the timing of valid ecephys segments is stored: None (constant rate),
+        'timestamps' (explicit timestamps) or 'series' (one series per segment).
+    min_segment_samples : int
+        With segment_mode 'series', ecephys segments shorter than this are not added.
+        Defaults to one second of samples, 0 keeps all segments.
+    apply_notch : bool
+        Apply the notch filter selected during the recording (if any) to ecephys data.
+    compression : str
+        HDF5 compression of ecephys and ophys data: 'gzip', 'lzf' or 'none'. If None,
+        it is set by the 'DataIO' section of metadata, or defaults to gzip.
+    compression_opts : int
+        gzip compression level (0-9). If None, set by metadata or defaults to 4.
+    shuffle : bool
+        Use the HDF5 shuffle filter with compression. If None, set by metadata or
+        defaults to True.
+    append : bool
+        If f_nwb exists, add the selected modalities to it instead of overwriting it.
+        Its session start time and trials are kept, and only new objects are written.
+    cache_tables : bool
+        Cache the parsed treadmill and LabView tables as hidden Feather files next to
+        the source files, reused by later conversions (requires pyarrow).
     **kwargs : key, value pairs
         Extra keyword arguments
     """
@@ -57,52 +97,91 @@ def conversion_function(source_paths, f_nwb, metadata, add_bpod=False, add_tread
             if k == 'dir_behavior_labview':
                 dir_behavior_labview = v['path']
 
-    nwbfile = None
-
-    # Adding bpod behavioral data
+    # Parse phases of all selected modalities, run concurrently as they do not
+    # depend on each other nor on the nwbfile
+    parsers = dict()
     if add_bpod:
-        nwbfile = add_behavior_bpod(
-            nwbfile=nwbfile,
-            metadata=metadata,
-            file_behavior_bpod=file_behavior_bpod,
-        )
-
-    # Adding ecephys
+        parsers['bpod'] = (parse_behavior_bpod, dict(file_behavior_bpod=file_behavior_bpod))
     if add_rhd:
-        nwbfile = add_ecephys_rhd(
-            nwbfile=nwbfile,
-            metadata=metadata,
-            source_dir=dir_ecephys_rhd,
-            electrodes_file=file_electrodes,
-        )
-
-    # Adding treadmill behavior
+        parsers['rhd'] = (parse_ecephys_rhd, dict(source_dir=dir_ecephys_rhd, electrodes_file=file_electrodes))
     if add_treadmill:
-        nwbfile = add_behavior_treadmill(
-            nwbfile=nwbfile,
-            metadata=metadata,
-            dir_behavior_treadmill=dir_behavior_treadmill,
-        )
-
-    # Adding LabView behavioral data
+        parsers['treadmill'] = (parse_behavior_treadmill, dict(dir_behavior_treadmill=dir_behavior_treadmill,
+                                                               cache=cache_tables))
     if add_labview:
-        nwbfile = add_behavior_labview(
-            nwbfile=nwbfile,
-            metadata=metadata,
-            dir_behavior_labview=dir_behavior_labview
-        )
-
-    # Adding optophys imaging data
+        parsers['labview'] = (parse_behavior_labview, dict(dir_behavior_labview=dir_behavior_labview,
+                                                           n_workers=n_workers, cache=cache_tables))
     if add_ophys:
-        nwbfile = add_ophys_rsd(
-            nwbfile=nwbfile,
-            metadata=metadata,
-            dir_cortical_imaging=dir_cortical_imaging
-        )
-
-    # Saves to NWB file
-    with NWBHDF5IO(f_nwb, mode='w') as io:
+        parsers['ophys'] = (parse_ophys_rsd, dict(dir_cortical_imaging=dir_cortical_imaging))
+    parsed = parse_concurrently(parsers)
+
+    # HDF5 chunking and compression of large datasets, per modality
+    data_io_overrides = dict(compression=compression, compression_opts=compression_opts, shuffle=shuffle)
+
+    # Existing nwbfile in append mode, with its session start time and trials
+    io = None
+    if append and os.path.exists(f_nwb):
+        io = NWBHDF5IO(f_nwb, mode='a')
+    try:
+        # Attach phases, in order, to the shared nwbfile
+        nwbfile = io.read() if io is not None else None
+
+        # Adding bpod behavioral data
+        if add_bpod:
+            nwbfile = attach_behavior_bpod(
+                nwbfile=nwbfile,
+                metadata=metadata,
+                session=parsed['bpod'],
+            )
+
+        # Adding ecephys
+        if add_rhd:
+            nwbfile = attach_ecephys_rhd(
+                nwbfile=nwbfile,
+                metadata=metadata,
+                parsed=parsed['rhd'],
+                native_dtypes=native_dtypes,
+                n_workers=n_workers,
+                max_prefetch=max_prefetch,
+                segment_mode=segment_mode,
+                apply_notch=apply_notch,
+                data_io=data_io_settings(metadata, 'Ecephys', **data_io_overrides),
+                min_segment_samples=min_segment_samples,
+            )
+
+        # Adding treadmill behavior
+        if add_treadmill:
+            nwbfile = attach_behavior_treadmill(
+                nwbfile=nwbfile,
+                metadata=metadata,
+                parsed=parsed['treadmill'],
+            )
+
+        # Adding LabView behavioral data
+        if add_labview:
+            nwbfile = attach_behavior_labview(
+                nwbfile=nwbfile,
+                metadata=metadata,
+                parsed=parsed['labview'],
+            )
+
+        # Adding optophys imaging data
+        if add_ophys:
+            nwbfile = attach_ophys_rsd(
+                nwbfile=nwbfile,
+                metadata=metadata,
+                parsed=parsed['ophys'],
+                n_workers=n_workers,
+                max_prefetch=max_prefetch,
+                data_io=data_io_settings(metadata, 'Ophys', **data_io_overrides),
+            )
+
+        # Saves to NWB file, or writes the new objects to the existing one
+        if io is None:
+            io = NWBHDF5IO(f_nwb, mode='w')
         io.write(nwbfile)
+    finally:
+        if io is not None:
+            io.close()
     print('NWB file saved with size: ', os.stat(f_nwb).st_size / 1e6, ' mb')
 
 
@@ -187,6 +266,78 @@ def main():
         default=False,
         help="Whether to add the cortical imaging data to the NWB file or not",
     )
+    parser.add_argument(
+        "--native_dtypes",
+        action="store_true",
+        default=False,
+        help="Whether to keep ecephys data in its native int16 width or not",
+    )
+    parser.add_argument(
+        "--segment_mode",
+        default=None,
+        choices=['timestamps', 'series'],
+        help="How the timing of valid ecephys segments is stored. If not given, valid "
+             "samples are written with a constant rate.",
+    )
+    parser.add_argument(
+        "--min_segment_samples",
+        type=int,
+        default=None,
+        help="Minimum length of ecephys segments written as series (default: one second).",
+    )
+    parser.add_argument(
+        "--apply_notch",
+        action="store_true",
+        default=False,
+        help="Whether to apply the notch filter set during the recording to ecephys data or not",
+    )
+    parser.add_argument(
+        "--append",
+        action="store_true",
+        default=False,
+        help="Whether to add the data to an existing output file or not",
+    )
+
+    # HDF5 storage arguments
+    parser.add_argument(
+        "--compression",
+        default=None,
+        choices=['gzip', 'lzf', 'none'],
+        help="HDF5 compression of ecephys and ophys data. If not given, it is set by the "
+             "DataIO section of the metafile, or defaults to gzip.",
+    )
+    parser.add_argument(
+        "--compression_opts",
+        type=int,
+        default=None,
+        help="gzip compression level (0-9).",
+    )
+    parser.add_argument(
+        "--no_shuffle",
+        action="store_true",
+        default=False,
+        help="Whether to disable the HDF5 shuffle filter or not",
+    )
+
+    # Performance arguments
+    parser.add_argument(
+        "--n_workers",
+        type=int,
+        default=0,
+        help="Number of worker processes decoding source files in parallel.",
+    )
+    parser.add_argument(
+        "--max_prefetch",
+        type=int,
+        default=None,
+        help="Maximum number of decoded source files held in memory.",
+    )
+    parser.add_argument(
+        "--cache_tables",
+        action="store_true",
+        default=False,
+        help="Whether to cache parsed behavior tables next to the source files or not",
+    )
 
     if not sys.argv[1:]:
         args = parser.parse_args(["--help"])
@@ -216,7 +367,18 @@ def main():
         'add_treadmill': args.add_treadmill,
         'add_rhd': args.add_rhd,
         'add_labview': args.add_labview,
-        'add_ophys': args.add_ophys
+        'add_ophys': args.add_ophys,
+        'native_dtypes': args.native_dtypes,
+        'n_workers': args.n_workers,
+        'max_prefetch': args.max_prefetch,
+        'segment_mode': args.segment_mode,
+        'min_segment_samples': args.min_segment_samples,
+        'apply_notch': args.apply_notch,
+        'compression': args.compression,
+        'compression_opts': args.compression_opts,
+        'shuffle': False if args.no_shuffle else None,
+        'append': args.append,
+        'cache_tables': args.cache_tables,
     }
 
     conversion_function(
@@ -1,6 +1,10 @@
 from pynwb.behavior import BehavioralTimeSeries, BehavioralEvents
 from pynwb.ogen import OptogeneticStimulusSite, OptogeneticSeries
-from jaeger_lab_to_nwb.resources.create_nwbfile import create_nwbfile
+from jaeger_lab_to_nwb.resources.create_nwbfile import create_nwbfile, matches_session_start_time
+from jaeger_lab_to_nwb.resources.trials import make_trials_table, add_trials_from_dataframe
+from jaeger_lab_to_nwb.resources.read_tables import read_table, read_tables
+from jaeger_lab_to_nwb.resources.read_bpod import read_bpod_session
+from jaeger_lab_to_nwb.resources.timing import series_timing, linked_timing
 
 from datetime import datetime, timedelta
 import pandas as pd
@@ -8,242 +12,333 @@ import numpy as np
 import copy
 import os
 
+# Trials columns: source column in trials summary file, NWB name, dtype and description
+TREADMILL_TRIALS_COLUMNS = [
+    {'source': 'Fail', 'name': 'fail', 'dtype': None, 'description': 'no description'},
+    {'source': 'Reward Given', 'name': 'reward_given', 'dtype': None, 'description': 'no description'},
+    {'source': 'Total Rewards', 'name': 'total_rewards', 'dtype': None, 'description': 'no description'},
+    {'source': 'Init Dur', 'name': 'init_dur', 'dtype': None, 'description': 'no description'},
+    {'source': 'Light Dur', 'name': 'light_dur', 'dtype': None, 'description': 'no description'},
+    {'source': 'Motor Dur', 'name': 'motor_dur', 'dtype': None, 'description': 'no description'},
+    {'source': 'Post Motor', 'name': 'post_motor', 'dtype': None, 'description': 'no description'},
+    {'source': 'Speed', 'name': 'speed', 'dtype': None, 'description': 'no description'},
+    {'source': 'Speed Mode', 'name': 'speed_mode', 'dtype': None, 'description': 'no description'},
+    {'source': 'Amplitude', 'name': 'amplitude', 'dtype': None, 'description': 'no description'},
+    {'source': 'Period', 'name': 'period', 'dtype': None, 'description': 'no description'},
+    {'source': '+/- Deviation', 'name': 'deviation', 'dtype': None, 'description': 'no description'},
+]
+
+LABVIEW_TRIALS_COLUMNS = [
+    {'source': 'Result', 'name': 'results', 'dtype': np.int64,
+     'description': "0 means sucess (rewarded trial), 1 means licks during intitial "
+                    "period, which leads to a failed trial. 2 means early lick failure. 3 means "
+                    "wrong lick or no response."},
+    {'source': 'InitT', 'name': 'init_t', 'dtype': np.float64,
+     'description': "duration of initial delay period."},
+    {'source': 'SpecificResults', 'name': 'specific_results', 'dtype': np.int64,
+     'description': "Possible outcomes classified based on raw data & meta file (_tr.m)."},
+    {'source': 'ProbLeft', 'name': 'prob_left', 'dtype': np.float64,
+     'description': "probability for left trials in order to keep the number of "
+                    "left and right trials balanced within the session. "},
+    {'source': 'OptoDur', 'name': 'opto_dur', 'dtype': np.float64,
+     'description': "the duration of optical stimulation."},
+    {'source': 'LRew', 'name': 'l_rew_n', 'dtype': np.int64,
+     'description': "counting the number of left rewards."},
+    {'source': 'RRew', 'name': 'r_rew_n', 'dtype': np.int64,
+     'description': "counting the number of rightrewards."},
+    {'source': 'InterT', 'name': 'inter_t', 'dtype': np.float64,
+     'description': "inter-trial delay period."},
+    {'source': 'LTrial', 'name': 'l_trial', 'dtype': np.int64,
+     'description': "trial type (which side the air-puff is applied). 1 means "
+                    "left-trial, 0 means right-trial"},
+    {'source': 'ReactionTime', 'name': 'reaction_time', 'dtype': np.int64,
+     'description': "if it is a successful trial or wrong lick during response "
+                    "period trial: ReactionTime = time between the first decision "
+                    "lick and the beginning of the response period. If it is a failed "
+                    "trial due to early licks: reaction time = the duration of "
+                    "the air-puff period (in other words, when the animal licks "
+                    "during the sample period)."},
+    {'source': 'OptoCond', 'name': 'opto_cond', 'dtype': np.int64,
+     'description': "0: no opto. 1: opto is on during sample period. "
+                    "2: opto is on half way through the sample period (0.5s) "
+                    "and 0.5 during the response period. 3. opto is on during "
+                    "the response period."},
+    {'source': 'OptoTrial', 'name': 'opto_trial', 'dtype': np.int64,
+     'description': "1: opto trials. 0: Non-opto trials."},
+]
+
+# Columns of the LabView trials summary files, which have no header line
+LABVIEW_SUM_COLUMNS = ['Trial', 'StartT', 'EndT', 'Result', 'InitT', 'SpecificResults',
+                       'ProbLeft', 'OptoDur', 'LRew', 'RRew', 'InterT', 'LTrial',
+                       'ReactionTime', 'OptoCond', 'OptoTrial']
+
+# Explicit dtypes of continuous data: float64 timestamps, int8 flags, float32 signals
+LABVIEW_CONTINUOUS_DTYPES = {'Time': np.float64, 'Lick 1': np.int8, 'Lick 2': np.int8, 'Opto': np.int8}
+TREADMILL_CONTINUOUS_DTYPES = {'Time': np.float64}
+
 
 def add_behavior_bpod(nwbfile, metadata, file_behavior_bpod):
     """
     Reads behavioral data from bpod files and adds it to nwbfile.
+    Both MATLAB v5 and v7.3 (HDF5) .mat files are supported, see read_bpod_session.
+    """
+    return attach_behavior_bpod(nwbfile, metadata, parse_behavior_bpod(file_behavior_bpod))
+
+
+def parse_behavior_bpod(file_behavior_bpod):
+    """
+    Parse phase of add_behavior_bpod: reads the bpod file and computes the trials
+    states and events arrays, without touching any nwbfile.
     """
-    from scipy.io import loadmat
+    # Opens -.mat file and extracts the SessionData fields, as flat arrays
+    session = read_bpod_session(file_behavior_bpod)
 
-    # Opens -.mat file and extracts data
-    fdata = loadmat(file_behavior_bpod, struct_as_record=False, squeeze_me=True)
+    date_time_string = session['session_date'] + ' ' + session['session_start_time']
+    session['session_start_datetime'] = datetime.strptime(date_time_string, '%d-%b-%Y %H:%M:%S')
 
-    session_start_date = fdata['SessionData'].Info.SessionDate
-    session_start_time = fdata['SessionData'].Info.SessionStartTime_UTC
+    # Raw data - states visited in each trial, flattened over trials, with their trial and duration
+    n_trials = session['n_trials']
+    all_trials_states_names = session['all_states_names']
+    states_names = session['states_names']
+    states_trials = np.repeat(np.arange(n_trials), np.diff(session['states_offsets'], prepend=0))
+    states_durations = session['states_durations']
 
-    # Get initial metadata
+    # State presence and duration as (trials x states) arrays, via a state -> column index
+    # trial_number | ... | state1 | state1_dur | state2 | state2_dur ...
+    # The duration of a state is that of its first occurrence in the trial
+    state_column = {state: col for col, state in enumerate(all_trials_states_names)}
+    states_columns = np.array([state_column[name] for name in states_names], dtype=int)
+    _, first = np.unique(states_trials * len(all_trials_states_names) + states_columns, return_index=True)
+    state_data = np.zeros((n_trials, len(all_trials_states_names)), dtype=bool)
+    state_dur = np.full((n_trials, len(all_trials_states_names)), np.nan)
+    state_data[states_trials[first], states_columns[first]] = True
+    state_dur[states_trials[first], states_columns[first]] = states_durations[first]
+    session['state_data'] = state_data
+    session['state_dur'] = state_dur
+
+    # Events timestamps, from relative to the start of their trial to absolute
+    session['events_timestamps'] = {
+        event: relative_timestamps + np.repeat(session['trial_start_timestamps'], np.diff(offsets, prepend=0))
+        for event, (relative_timestamps, offsets) in session['events'].items()
+    }
+    return session
+
+
+def attach_behavior_bpod(nwbfile, metadata, session):
+    """Attach phase of add_behavior_bpod: adds the output of parse_behavior_bpod to nwbfile."""
+    # Create nwbfile / test for matching start_time in existing nwbfile
     meta_init = copy.deepcopy(metadata)
     if nwbfile is None:
-        date_time_string = session_start_date + ' ' + session_start_time
-        date_time_obj = datetime.strptime(date_time_string, '%d-%b-%Y %H:%M:%S')
-        meta_init['NWBFile']['session_start_time'] = date_time_obj
+        meta_init['NWBFile']['session_start_time'] = session['session_start_datetime']
         nwbfile = create_nwbfile(meta_init)
-
-    # Summarized trials data
-    n_trials = fdata['SessionData'].nTrials
-    trials_start_times = fdata['SessionData'].TrialStartTimestamp
-    trials_end_times = fdata['SessionData'].TrialEndTimestamp
-    trials_types = fdata['SessionData'].TrialTypes
-    trials_led_types = fdata['SessionData'].LEDTypes
-    trials_reaching = fdata['SessionData'].Reaching
-    trials_outcome = fdata['SessionData'].Outcome
-
-    # Raw data - states
-    trials_states_names_by_number = fdata['SessionData'].RawData.OriginalStateNamesByNumber
-    all_trials_states_names = np.unique(np.concatenate(trials_states_names_by_number, axis=0))
-    trials_states_numbers = fdata['SessionData'].RawData.OriginalStateData
-    trials_states_timestamps = fdata['SessionData'].RawData.OriginalStateTimestamps
-    trials_states_durations = [np.diff(dur) for dur in trials_states_timestamps]
-
-    # # Add trials columns
-    nwbfile.add_trial_column(name='trial_type', description='no description')
-    nwbfile.add_trial_column(name='led_type', description='no description')
-    nwbfile.add_trial_column(name='reaching', description='no description')
-    nwbfile.add_trial_column(name='outcome', description='no description')
-    nwbfile.add_trial_column(name='states', description='no description', index=True)
+    else:
+        if not matches_session_start_time(nwbfile, session['session_start_datetime']):
+            print("Session start time in current nwbfile does not match the start time from Bpod file.")
+            print("Bpod data conversion aborted.")
+            return nwbfile
 
     # Trials table structure:
     # trial_number | start | end | trial_type | led_type | reaching | outcome | states (list)
-    trials_states_names = []
-    tup_ts = np.array([])
-    port_1_in_ts = np.array([])
-    port_1_out_ts = np.array([])
-    port_2_in_ts = np.array([])
-    port_2_out_ts = np.array([])
-    for tr in range(n_trials):
-        trials_states_names.append([trials_states_names_by_number[tr][number - 1]
-                                    for number in trials_states_numbers[tr]])
-        nwbfile.add_trial(
-            start_time=trials_start_times[tr],
-            stop_time=trials_end_times[tr],
-            trial_type=trials_types[tr],
-            led_type=trials_led_types[tr],
-            reaching=trials_reaching[tr],
-            outcome=trials_outcome[tr],
-            states=trials_states_names[tr],
+    if nwbfile.trials is not None:
+        print('Trials already exist in current nwb file. Bpod behavior trials not added.')
+    else:
+        columns = [
+            {'name': 'trial_type', 'description': 'no description', 'data': session['trial_types']},
+            {'name': 'led_type', 'description': 'no description', 'data': session['led_types']},
+            {'name': 'reaching', 'description': 'no description', 'data': session['reaching']},
+            {'name': 'outcome', 'description': 'no description', 'data': session['outcome']},
+            {'name': 'states', 'description': 'no description', 'data': list(session['states_names']),
+             'index': session['states_offsets']},
+        ]
+        for col, state in enumerate(session['all_states_names']):
+            columns.append({'name': state, 'description': 'no description', 'data': session['state_data'][:, col]})
+            columns.append({'name': state + '_dur', 'description': 'no description', 'data': session['state_dur'][:, col]})
+        nwbfile.trials = make_trials_table(
+            start_time=session['trial_start_timestamps'],
+            stop_time=session['trial_end_timestamps'],
+            columns=columns
         )
 
-        # Events names: ['Tup', 'Port2In', 'Port2Out', 'Port1In', 'Port1Out']
-        trial_events_names = fdata['SessionData'].RawEvents.Trial[tr].Events._fieldnames
-        t0 = trials_start_times[tr]
-        if 'Port1In' in trial_events_names:
-            timestamps = fdata['SessionData'].RawEvents.Trial[tr].Events.Port1In + t0
-            port_1_in_ts = np.append(port_1_in_ts, timestamps)
-        if 'Port1Out' in trial_events_names:
-            timestamps = fdata['SessionData'].RawEvents.Trial[tr].Events.Port1Out + t0
-            port_1_out_ts = np.append(port_1_out_ts, timestamps)
-        if 'Port2In' in trial_events_names:
-            timestamps = fdata['SessionData'].RawEvents.Trial[tr].Events.Port2In + t0
-            port_2_in_ts = np.append(port_2_in_ts, timestamps)
-        if 'Port2Out' in trial_events_names:
-            timestamps = fdata['SessionData'].RawEvents.Trial[tr].Events.Port2Out + t0
-            port_2_out_ts = np.append(port_2_out_ts, timestamps)
-        if 'Tup' in trial_events_names:
-            timestamps = fdata['SessionData'].RawEvents.Trial[tr].Events.Tup + t0
-            tup_ts = np.append(tup_ts, timestamps)
-
-    # Add states and durations
-    # trial_number | ... | state1 | state1_dur | state2 | state2_dur ...
-    for state in all_trials_states_names:
-        state_data = []
-        state_dur = []
-        for tr in range(n_trials):
-            if state in trials_states_names[tr]:
-                state_data.append(True)
-                dur = trials_states_durations[tr][trials_states_names[tr].index(state)]
-                state_dur.append(dur)
-            else:
-                state_data.append(False)
-                state_dur.append(np.nan)
-        nwbfile.add_trial_column(
-            name=state,
-            description='no description',
-            data=state_data,
-        )
-        nwbfile.add_trial_column(
-            name=state + '_dur',
-            description='no description',
-            data=state_dur,
-        )
+    # Events names: ['Tup', 'Port2In', 'Port2Out', 'Port1In', 'Port1Out']
+    events_names = {'Port1In': 'port_1_in', 'Port1Out': 'port_1_out', 'Port2In': 'port_2_in',
+                    'Port2Out': 'port_2_out', 'Tup': 'tup'}
 
     # Add events
     behavioral_events = BehavioralEvents()
-    behavioral_events.create_timeseries(name='port_1_in', timestamps=port_1_in_ts)
-    behavioral_events.create_timeseries(name='port_1_out', timestamps=port_1_out_ts)
-    behavioral_events.create_timeseries(name='port_2_in', timestamps=port_2_in_ts)
-    behavioral_events.create_timeseries(name='port_2_out', timestamps=port_2_out_ts)
-    behavioral_events.create_timeseries(name='tup', timestamps=tup_ts)
+    for event in ['Port1In', 'Port1Out', 'Port2In', 'Port2Out', 'Tup']:
+        behavioral_events.create_timeseries(name=events_names[event],
+                                            timestamps=session['events_timestamps'].get(event, np.array([])))
 
     nwbfile.add_acquisition(behavioral_events)
 
     return nwbfile
 
 
-def add_behavior_treadmill(nwbfile, metadata, dir_behavior_treadmill):
+def add_behavior_treadmill(nwbfile, metadata, dir_behavior_treadmill, cache=False):
     """
     Reads treadmill experiment behavioral data from csv files and adds it to nwbfile.
+    Continuous signals are read as float32. If cache is True, parsed tables are cached
+    as Feather files next to the source files (requires pyarrow).
+    """
+    return attach_behavior_treadmill(nwbfile, metadata, parse_behavior_treadmill(dir_behavior_treadmill, cache=cache))
+
+
+def parse_behavior_treadmill(dir_behavior_treadmill, cache=False):
+    """
+    Parse phase of add_behavior_treadmill: reads the trials summary, treadmill and
+    nose files, without touching any nwbfile.
     """
     # Detect relevant files: trials summary, treadmill data and nose data
     all_files = os.listdir(dir_behavior_treadmill)
-    trials_file = [f for f in all_files if ('_tr.csv' in f and '~lock' not in f)][0]
+    trials_file = [f for f in all_files if (f.endswith('_tr.csv') and '~lock' not in f)][0]
     treadmill_file = trials_file.split('_tr')[0] + '.csv'
     nose_file = trials_file.split('_tr')[0] + '_mk.csv'
 
+    # Session start time from trials summary file name, e.g. UD09_200301_100000_tr.csv
+    date_string = trials_file.split('.')[0].split('_')[1]
+    time_string = trials_file.split('.')[0].split('_')[2]
+    date_time_string = date_string + ' ' + time_string
+    session_start_time = datetime.strptime(date_time_string, '%y%m%d %H%M%S')
+
     trials_file = os.path.join(dir_behavior_treadmill, trials_file)
     treadmill_file = os.path.join(dir_behavior_treadmill, treadmill_file)
     nose_file = os.path.join(dir_behavior_treadmill, nose_file)
 
-    # Get initial metadata
+    # Trials summary
+    df_trials_summary = read_table(trials_file, cache=cache)
+
+    # Treadmill and nose position continuous data
+    df_treadmill, df_nose = read_tables(
+        [treadmill_file, nose_file],
+        n_workers=2,
+        dtype=TREADMILL_CONTINUOUS_DTYPES,
+        float_dtype='float32',
+        cache=cache
+    )
+
+    # All behavioral data
+    df_all = pd.concat([df_treadmill, df_nose], axis=1, sort=False)
+
+    return {'session_start_time': session_start_time, 'trials': df_trials_summary, 'continuous': df_all}
+
+
+def attach_behavior_treadmill(nwbfile, metadata, parsed):
+    """Attach phase of add_behavior_treadmill: adds the output of parse_behavior_treadmill to nwbfile."""
+    # Create nwbfile / test for matching start_time in existing nwbfile
     meta_init = copy.deepcopy(metadata)
     if nwbfile is None:
-        date_string = trials_file[0].split('.')[0].split('_')[1]
-        time_string = trials_file[0].split('.')[0].split('_')[2]
-        date_time_string = date_string + ' ' + time_string
-        date_time_obj = datetime.strptime(date_time_string, '%y%m%d %H%M%S')
-        meta_init['NWBFile']['session_start_time'] = date_time_obj
+        meta_init['NWBFile']['session_start_time'] = parsed['session_start_time']
         nwbfile = create_nwbfile(meta_init)
+    else:
+        if not matches_session_start_time(nwbfile, parsed['session_start_time']):
+            print("Session start time in current nwbfile does not match the start time from treadmill files.")
+            print("Treadmill data conversion aborted.")
+            return nwbfile
 
     # Add trials
     if nwbfile.trials is not None:
         print('Trials already exist in current nwb file. Treadmill behavior trials not added.')
     else:
-        df_trials_summary = pd.read_csv(trials_file)
-
-        nwbfile.add_trial_column(name='fail', description='no description')
-        nwbfile.add_trial_column(name='reward_given', description='no description')
-        nwbfile.add_trial_column(name='total_rewards', description='no description')
-        nwbfile.add_trial_column(name='init_dur', description='no description')
-        nwbfile.add_trial_column(name='light_dur', description='no description')
-        nwbfile.add_trial_column(name='motor_dur', description='no description')
-        nwbfile.add_trial_column(name='post_motor', description='no description')
-        nwbfile.add_trial_column(name='speed', description='no description')
-        nwbfile.add_trial_column(name='speed_mode', description='no description')
-        nwbfile.add_trial_column(name='amplitude', description='no description')
-        nwbfile.add_trial_column(name='period', description='no description')
-        nwbfile.add_trial_column(name='deviation', description='no description')
-
-        t_offset = df_trials_summary.loc[0]['Start Time']
-        for index, row in df_trials_summary.iterrows():
-            nwbfile.add_trial(
-                start_time=row['Start Time'] - t_offset,
-                stop_time=row['End Time'] - t_offset,
-                fail=row['Fail'],
-                reward_given=row['Reward Given'],
-                total_rewards=row['Total Rewards'],
-                init_dur=row['Init Dur'],
-                light_dur=row['Light Dur'],
-                motor_dur=row['Motor Dur'],
-                post_motor=row['Post Motor'],
-                speed=row['Speed'],
-                speed_mode=row['Speed Mode'],
-                amplitude=row['Amplitude'],
-                period=row['Period'],
-                deviation=row['+/- Deviation'],
-            )
+        df_trials_summary = parsed['trials']
+
+        t_offset = df_trials_summary['Start Time'][0]
+        add_trials_from_dataframe(
+            nwbfile=nwbfile,
+            df=df_trials_summary,
+            columns_spec=TREADMILL_TRIALS_COLUMNS,
+            start_time=df_trials_summary['Start Time'].to_numpy() - t_offset,
+            stop_time=df_trials_summary['End Time'].to_numpy() - t_offset
+        )
 
     # Create BehavioralTimeSeries container
     behavioral_ts = BehavioralTimeSeries()
     meta_behavioral_ts = metadata['Behavior']['BehavioralTimeSeries']['time_series']
+    df_all = parsed['continuous']
 
-    # Treadmill continuous data
-    df_treadmill = pd.read_csv(treadmill_file, index_col=False)
-
-    # Nose position continuous data
-    df_nose = pd.read_csv(nose_file, index_col=False)
-
-    # All behavioral data
-    df_all = pd.concat([df_treadmill, df_nose], axis=1, sort=False)
-
-    t_offset = df_treadmill.loc[0]['Time']
+    # Timestamps are shared by all series: starting_time and rate if uniformly sampled,
+    # otherwise stored by the first series and linked by the others
+    time = df_all['Time'].to_numpy()
+    timing = series_timing(time - time[0])
     for meta in meta_behavioral_ts:
-        behavioral_ts.create_timeseries(
+        series = behavioral_ts.create_timeseries(
             name=meta['name'],
             data=df_all[meta['name']].to_numpy(),
-            timestamps=df_all['Time'].to_numpy() - t_offset,
-            description=meta['description']
+            description=meta['description'],
+            **timing
         )
+        timing = linked_timing(timing, series)
 
     nwbfile.add_acquisition(behavioral_ts)
 
     return nwbfile
 
 
-def add_behavior_labview(nwbfile, metadata, dir_behavior_labview):
+def add_behavior_labview(nwbfile, metadata, dir_behavior_labview, n_workers=0, cache=False):
     """
     Reads behavioral data from txt files and adds it to nwbfile.
+    If n_workers > 0, the per-trial files are read in a thread pool. Licks and opto
+    are read as int8 flags. If cache is True, parsed tables are cached as Feather
+    files next to the source files (requires pyarrow).
+    """
+    parsed = parse_behavior_labview(dir_behavior_labview, n_workers=n_workers, cache=cache)
+    return attach_behavior_labview(nwbfile, metadata, parsed)
+
+
+def parse_behavior_labview(dir_behavior_labview, n_workers=0, cache=False):
+    """
+    Parse phase of add_behavior_labview: reads the trials summary and continuous
+    files, without touching any nwbfile.
     """
     # Get list of trial summary files
     all_files = os.listdir(dir_behavior_labview)
-    trials_files = [f for f in all_files if '_sum.txt' in f]
+    trials_files = [f for f in all_files if f.endswith('_sum.txt')]
     trials_files.sort()
 
+    # Trials summary files, read once
+    frames = read_tables(
+        [os.path.join(dir_behavior_labview, f) for f in trials_files],
+        n_workers=n_workers,
+        sep='\t',
+        names=LABVIEW_SUM_COLUMNS,
+        dtype={col: np.float64 for col in LABVIEW_SUM_COLUMNS},
+        cache=cache
+    )
+
     # Get session_start_time from first file timestamps
     labview_time_offset = datetime.strptime('01/01/1904 00:00:00', '%m/%d/%Y %H:%M:%S')  # LabView timestamps offset
-    fpath = os.path.join(dir_behavior_labview, trials_files[0])
-    colnames = ['Trial', 'StartT', 'EndT', 'Result', 'InitT', 'SpecificResults',
-                'ProbLeft', 'OptoDur', 'LRew', 'RRew', 'InterT', 'LTrial',
-                'ReactionTime', 'OptoCond', 'OptoTrial']
-    df_0 = pd.read_csv(fpath, sep='\t', index_col=False, names=colnames)
-    t0 = df_0['StartT'][0]   # initial time in Labview seconds
+    t0 = frames[0]['StartT'][0]   # initial time in Labview seconds
     session_start_time = labview_time_offset + timedelta(seconds=t0)
 
+    # Get list of files: continuous data
+    continuous_files = [f.replace('_sum', '') for f in trials_files]
+    continuous_frames = read_tables(
+        [os.path.join(dir_behavior_labview, f) for f in continuous_files],
+        n_workers=n_workers,
+        sep='\t',
+        dtype=LABVIEW_CONTINUOUS_DTYPES,
+        cache=cache
+    )
+
+    return {
+        'session_start_time': session_start_time,
+        't0': t0,
+        'trials': pd.concat(frames),
+        'continuous': pd.concat(continuous_frames),
+    }
+
+
+def attach_behavior_labview(nwbfile, metadata, parsed):
+    """Attach phase of add_behavior_labview: adds the output of parse_behavior_labview to nwbfile."""
+    session_start_time = parsed['session_start_time']
+    t0 = parsed['t0']
+
     # Create nwbfile / test for matching start_time in existing nwbfile
     meta_init = copy.deepcopy(metadata)
     if nwbfile is None:
         meta_init['NWBFile']['session_start_time'] = session_start_time
         nwbfile = create_nwbfile(meta_init)
     else:
-        if session_start_time != nwbfile.session_start_time:
+        if not matches_session_start_time(nwbfile, session_start_time):
             print("Session start time in current nwbfile does not match the start time from Labview files.")
             print("Labview data conversion aborted.")
             return nwbfile
@@ -252,114 +347,37 @@ def add_behavior_labview(nwbfile, metadata, dir_behavior_labview):
     if nwbfile.trials is not None:
         print('Trials already exist in current nwb file. Labview behavior trials not added.')
     else:
-        # Make dataframe
-        frames = []
-        for f in trials_files:
-            fpath = os.path.join(dir_behavior_labview, f)
-            frames.append(pd.read_csv(fpath, sep='\t', index_col=False, names=colnames))
-        df_trials_summary = pd.concat(frames)
-
-        nwbfile.add_trial_column(
-            name='results',
-            description="0 means sucess (rewarded trial), 1 means licks during intitial "
-                        "period, which leads to a failed trial. 2 means early lick failure. 3 means "
-                        "wrong lick or no response."
+        df_trials_summary = parsed['trials']
+
+        add_trials_from_dataframe(
+            nwbfile=nwbfile,
+            df=df_trials_summary,
+            columns_spec=LABVIEW_TRIALS_COLUMNS,
+            start_time=df_trials_summary['StartT'].to_numpy() - t0,
+            stop_time=df_trials_summary['EndT'].to_numpy() - t0
         )
-        nwbfile.add_trial_column(
-            name='init_t',
-            description="duration of initial delay period."
-        )
-        nwbfile.add_trial_column(
-            name='specific_results',
-            description="Possible outcomes classified based on raw data & meta file (_tr.m)."
-        )
-        nwbfile.add_trial_column(
-            name='prob_left',
-            description="probability for left trials in order to keep the number of "
-                        "left and right trials balanced within the session. "
-        )
-        nwbfile.add_trial_column(
-            name='opto_dur',
-            description="the duration of optical stimulation."
-        )
-        nwbfile.add_trial_column(
-            name='l_rew_n',
-            description="counting the number of left rewards."
-        )
-        nwbfile.add_trial_column(
-            name='r_rew_n',
-            description="counting the number of rightrewards."
-        )
-        nwbfile.add_trial_column(
-            name='inter_t',
-            description="inter-trial delay period."
-        )
-        nwbfile.add_trial_column(
-            name='l_trial',
-            description="trial type (which side the air-puff is applied). 1 means "
-                        "left-trial, 0 means right-trial"
-        )
-        nwbfile.add_trial_column(
-            name='reaction_time',
-            description="if it is a successful trial or wrong lick during response "
-                        "period trial: ReactionTime = time between the first decision "
-                        "lick and the beginning of the response period. If it is a failed "
-                        "trial due to early licks: reaction time = the duration of "
-                        "the air-puff period (in other words, when the animal licks "
-                        "during the sample period)."
-        )
-        nwbfile.add_trial_column(
-            name='opto_cond',
-            description="0: no opto. 1: opto is on during sample period. "
-                        "2: opto is on half way through the sample period (0.5s) "
-                        "and 0.5 during the response period. 3. opto is on during "
-                        "the response period."
-        )
-        nwbfile.add_trial_column(
-            name='opto_trial',
-            description="1: opto trials. 0: Non-opto trials."
-        )
-        for index, row in df_trials_summary.iterrows():
-            nwbfile.add_trial(
-                start_time=row['StartT'] - t0,
-                stop_time=row['EndT'] - t0,
-                results=int(row['Result']),
-                init_t=row['InitT'],
-                specific_results=int(row['SpecificResults']),
-                prob_left=row['ProbLeft'],
-                opto_dur=row['OptoDur'],
-                l_rew_n=int(row['LRew']),
-                r_rew_n=int(row['RRew']),
-                inter_t=row['InterT'],
-                l_trial=int(row['LTrial']),
-                reaction_time=int(row['ReactionTime']),
-                opto_cond=int(row['OptoCond']),
-                opto_trial=int(row['OptoTrial']),
-            )
-
-    # Get list of files: continuous data
-    continuous_files = [f.replace('_sum', '') for f in trials_files]
 
     # Adds continuous behavioral data
-    frames = []
-    for f in continuous_files:
-        fpath_lick = os.path.join(dir_behavior_labview, f)
-        frames.append(pd.read_csv(fpath_lick, sep='\t', index_col=False))
-    df_continuous = pd.concat(frames)
+    df_continuous = parsed['continuous']
+
+    # Timestamps are shared by all series: starting_time and rate if uniformly sampled,
+    # otherwise stored by left_lick and linked by the others
+    timing = series_timing(df_continuous['Time'].to_numpy() - t0)
 
     # Behavioral data
     behavioral_ts = BehavioralTimeSeries()
-    behavioral_ts.create_timeseries(
+    left_lick = behavioral_ts.create_timeseries(
         name="left_lick",
         data=df_continuous['Lick 1'].to_numpy(),
-        timestamps=df_continuous['Time'].to_numpy() - t0,
-        description="no description"
+        description="no description",
+        **timing
     )
+    timing = linked_timing(timing, left_lick)
     behavioral_ts.create_timeseries(
         name="right_lick",
         data=df_continuous['Lick 2'].to_numpy(),
-        timestamps=df_continuous['Time'].to_numpy() - t0,
-        description="no description"
+        description="no description",
+        **timing
     )
     nwbfile.add_acquisition(behavioral_ts)
 
@@ -381,8 +399,8 @@ def add_behavior_labview(nwbfile, metadata, dir_behavior_labview):
         name=meta_ogen_series['name'],
         data=df_continuous['Opto'].to_numpy(),
         site=ogen_stim_site,
-        timestamps=df_continuous['Time'].to_numpy() - t0,
         description=meta_ogen_series['description'],
+        **timing
     )
     nwbfile.add_stimulus(ogen_series)
 
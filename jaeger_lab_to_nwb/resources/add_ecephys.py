@@ -1,7 +1,11 @@
 from pynwb.ecephys import ElectricalSeries
-from hdmf.data_utils import DataChunkIterator
-from jaeger_lab_to_nwb.resources.create_nwbfile import create_nwbfile
-from jaeger_lab_to_nwb.resources.load_intan import load_intan, read_header
+from jaeger_lab_to_nwb.resources.create_nwbfile import create_nwbfile, matches_session_start_time
+from jaeger_lab_to_nwb.resources.data_iterators import RHDDataChunkIterator, TimestampsChunkIterator
+from jaeger_lab_to_nwb.resources.load_intan.scale_data import AMPLIFIER_DATA_CONVERSION_FACTOR
+from jaeger_lab_to_nwb.resources.load_intan.notch_filter import NotchFilter
+from jaeger_lab_to_nwb.resources.session_index import (index_rhd_session, rhd_valid_segments, join_file_segments,
+                                                       drop_short_segments)
+from jaeger_lab_to_nwb.resources.data_io import data_io_settings, wrap_data_io
 
 from datetime import datetime
 from pathlib import Path
@@ -11,49 +15,117 @@ import copy
 import os
 
 
-def add_ecephys_rhd(nwbfile, metadata, source_dir, electrodes_file=None):
+def add_ecephys_rhd(nwbfile, metadata, source_dir, electrodes_file=None, native_dtypes=False,
+                    n_workers=0, max_prefetch=None, segment_mode=None, apply_notch=False, data_io=None,
+                    min_segment_samples=None):
     """
     Reads extracellular electrophysiology data from .rhd files and adds data to nwbfile.
+    If native_dtypes is True, amplifier data is stored as int16 instead of int32.
+    If n_workers > 0, the next files are decoded in a process pool while the current
+    one is written, holding at most max_prefetch decoded files in memory.
+
+    Only samples flagged as valid by the first board digital input are written. They
+    are grouped in segments of contiguous timestamps, and segment_mode sets how their
+    timing is stored:
+    None - valid samples are concatenated in one series with a constant rate
+    'timestamps' - one series with explicit timestamps for each sample
+    'series' - one series per segment, each with its own starting_time
+
+    In 'series' mode, segments shorter than min_segment_samples (after joining segments
+    that continue across files) are dropped, so that a valid flag flickering between
+    short runs does not make thousands of tiny series. Segments are not merged across
+    gaps, whose samples are invalid or missing. Defaults to one second of samples, 0
+    keeps all segments. Other modes keep all valid samples.
+
+    If apply_notch is True and a notch filter frequency was set during the recording,
+    the same notch filter is applied to amplifier data as it is written.
+
+    data_io sets the HDF5 chunking and compression of amplifier data, see
+    data_io.data_io_settings. If None, they are set by the 'DataIO' section of metadata,
+    or default to gzip compression (level 4, with shuffle).
+    """
+    parsed = parse_ecephys_rhd(source_dir=source_dir, electrodes_file=electrodes_file)
+    return attach_ecephys_rhd(
+        nwbfile=nwbfile,
+        metadata=metadata,
+        parsed=parsed,
+        native_dtypes=native_dtypes,
+        n_workers=n_workers,
+        max_prefetch=max_prefetch,
+        segment_mode=segment_mode,
+        apply_notch=apply_notch,
+        data_io=data_io,
+        min_segment_samples=min_segment_samples
+    )
+
+
+def parse_ecephys_rhd(source_dir, electrodes_file=None):
     """
+    Parse phase of add_ecephys_rhd: indexes the .rhd files, finds their valid segments
+    and reads the electrodes file, without touching any nwbfile.
+    """
+    # Gets header data of all files, from the session index
+    index = index_rhd_session(source_dir=source_dir)
+    all_files = [os.path.join(source_dir, rec['name']) for rec in index['files']]
+
+    # Session start time from first file name
+    date_string = Path(all_files[0]).name.split('.')[0].split('_')[1]
+    time_string = Path(all_files[0]).name.split('.')[0].split('_')[2]
+    date_time_string = date_string + ' ' + time_string
+    session_start_time = datetime.strptime(date_time_string, '%y%m%d %H%M%S')
+
+    # Valid segments of each file
+    file_segments = rhd_valid_segments(source_dir=source_dir, index=index)
+
+    # Electrodes info file, if provided
+    df_electrodes = None
+    if electrodes_file is not None:
+        df_electrodes = pd.read_csv(electrodes_file, index_col='Channel Number')
+
+    return {
+        'index': index,
+        'all_files': all_files,
+        'session_start_time': session_start_time,
+        'file_segments': file_segments,
+        'electrodes': df_electrodes,
+    }
+
 
-    def data_gen(source_dir):
-        all_files = [os.path.join(source_dir, file) for file in os.listdir(source_dir) if file.endswith(".rhd")]
-        n_files = len(all_files)
-        # Iterates over all files within the directory
-        for ii, fname in enumerate(all_files):
-            print("Converting ecephys rhd data: {}%".format(100 * ii / n_files))
-            file_data = load_intan.read_data(filename=fname)
-            # Gets only valid timestamps
-            valid_ts = file_data['board_dig_in_data'][0]
-            analog_data = file_data['amplifier_data'][:, valid_ts]
-            n_samples = analog_data.shape[1]
-            for sample in range(n_samples):
-                yield analog_data[:, sample]
-
-    # Gets header data from first file
-    all_files = [os.path.join(source_dir, file) for file in os.listdir(source_dir) if file.endswith(".rhd")]
-    all_files.sort()
-    fid = open(all_files[0], 'rb')
-    header = read_header.read_header(fid)
+def attach_ecephys_rhd(nwbfile, metadata, parsed, native_dtypes=False, n_workers=0, max_prefetch=None,
+                       segment_mode=None, apply_notch=False, data_io=None, min_segment_samples=None):
+    """Attach phase of add_ecephys_rhd: adds the output of parse_ecephys_rhd to nwbfile."""
+    if data_io is None:
+        data_io = data_io_settings(metadata, 'Ecephys')
+    index = parsed['index']
+    all_files = parsed['all_files']
+    header = index['header']
     sampling_rate = header['sample_rate']
 
     # Gets electrodes info from first rhd file
-    file_data = load_intan.read_data(filename=all_files[0])
-    electrodes_info = file_data['amplifier_channels']
+    electrodes_info = header['amplifier_channels']
     n_electrodes = len(electrodes_info)
 
-    # Get initial metadata
+    # Gets electricalseries conversion factor
+    es_conversion_factor = AMPLIFIER_DATA_CONVERSION_FACTOR
+
+    # Notch filter, as selected during the recording
+    notch_frequency = header['notch_filter_frequency'] if apply_notch else 0
+    filtering = 'none'
+    if notch_frequency > 0:
+        filtering = '{} Hz notch filter'.format(notch_frequency)
+    elif apply_notch:
+        print('No notch filter frequency set in rhd header, data is not filtered.')
+
+    # Create nwbfile / test for matching start_time in existing nwbfile
     meta_init = copy.deepcopy(metadata)
     if nwbfile is None:
-        date_string = Path(all_files[0]).name.split('.')[0].split('_')[1]
-        time_string = Path(all_files[0]).name.split('.')[0].split('_')[2]
-        date_time_string = date_string + ' ' + time_string
-        date_time_obj = datetime.strptime(date_time_string, '%y%m%d %H%M%S')
-        meta_init['NWBFile']['session_start_time'] = date_time_obj
+        meta_init['NWBFile']['session_start_time'] = parsed['session_start_time']
         nwbfile = create_nwbfile(meta_init)
-
-    # Gets electricalseries conversion factor
-    es_conversion_factor = file_data['amplifier_data_conversion_factor']
+    else:
+        if not matches_session_start_time(nwbfile, parsed['session_start_time']):
+            print("Session start time in current nwbfile does not match the start time from rhd files.")
+            print("Ecephys data conversion aborted.")
+            return nwbfile
 
     # Adds Device
     device = nwbfile.create_device(name=metadata['Ecephys']['Device'][0]['name'])
@@ -69,8 +141,8 @@ def add_ecephys_rhd(nwbfile, metadata, source_dir, electrodes_file=None):
         )
 
     # Electrodes
-    if electrodes_file is not None:  # if an electrodes info file was provided
-        df_electrodes = pd.read_csv(electrodes_file, index_col='Channel Number')
+    if parsed['electrodes'] is not None:  # if an electrodes info file was provided
+        df_electrodes = parsed['electrodes']
         for idx, elec in enumerate(electrodes_info):
             elec_name = elec['native_channel_name']
             elec_group = df_electrodes.loc[elec_name]['electrode_group']
@@ -80,7 +152,7 @@ def add_ecephys_rhd(nwbfile, metadata, source_dir, electrodes_file=None):
                 x=np.nan, y=np.nan, z=np.nan,
                 imp=float(elec_imp),
                 location='location',
-                filtering='none',
+                filtering=filtering,
                 group=nwbfile.electrode_groups[elec_group]
             )
     else:  # if no electrodes file info was provided
@@ -92,7 +164,7 @@ def add_ecephys_rhd(nwbfile, metadata, source_dir, electrodes_file=None):
                 x=np.nan, y=np.nan, z=np.nan,
                 imp=np.nan,
                 location='location',
-                filtering='none',
+                filtering=filtering,
                 group=electrode_group
             )
 
@@ -101,24 +173,82 @@ def add_ecephys_rhd(nwbfile, metadata, source_dir, electrodes_file=None):
         description='no description'
     )
 
+    file_segments = parsed['file_segments']
+    meta_es = metadata['Ecephys']['ElectricalSeries'][0]
+
+    if segment_mode == 'series':
+        # One ElectricalSeries per valid segment, each with its own starting_time
+        if min_segment_samples is None:
+            min_segment_samples = int(sampling_rate)
+        t_ref = index['files'][0]['first_timestamp']
+        all_segments = join_file_segments(index=index, file_segments=file_segments)
+        segments = drop_short_segments(all_segments, min_segment_samples)
+        if len(segments) < len(all_segments):
+            n_dropped = sum(segment['n_samples'] for segment in all_segments) - \
+                sum(segment['n_samples'] for segment in segments)
+            print('{} valid segments shorter than {} samples ({} samples in total) not added.'.format(
+                len(all_segments) - len(segments), min_segment_samples, n_dropped))
+        for ii, segment in enumerate(segments):
+            data_iter = RHDDataChunkIterator(
+                files=[all_files[piece[0]] for piece in segment['pieces']],
+                native_dtypes=native_dtypes,
+                n_workers=n_workers,
+                max_prefetch=max_prefetch,
+                file_segments=[[piece[1:]] for piece in segment['pieces']],
+                notch=make_notch(sampling_rate, notch_frequency)
+            )
+            ephys_ts = ElectricalSeries(
+                name=meta_es['name'] + '_' + str(ii),
+                description=meta_es['description'],
+                data=wrap_data_io(data_iter, data_io),
+                electrodes=electrode_table_region,
+                rate=sampling_rate,
+                starting_time=(segment['first_timestamp'] - t_ref) / sampling_rate,
+                conversion=es_conversion_factor
+            )
+            nwbfile.add_acquisition(ephys_ts)
+        return nwbfile
+
     # Create iterator
-    data_iter = DataChunkIterator(
-        data=data_gen(source_dir=source_dir),
-        iter_axis=0,
-        buffer_size=10000,
-        maxshape=(None, n_electrodes)
+    data_iter = RHDDataChunkIterator(
+        files=all_files,
+        native_dtypes=native_dtypes,
+        n_workers=n_workers,
+        max_prefetch=max_prefetch,
+        file_segments=file_segments,
+        notch=make_notch(sampling_rate, notch_frequency)
     )
 
+    if segment_mode == 'timestamps':
+        # Explicit timestamps, relative to the first sample of the session
+        t_ref = index['files'][0]['first_timestamp']
+        segments = [seg for segments in file_segments for seg in segments]
+        timing = dict(
+            timestamps=TimestampsChunkIterator(
+                starting_times=[(seg[2] - t_ref) / sampling_rate for seg in segments],
+                n_samples=[seg[1] - seg[0] for seg in segments],
+                rate=sampling_rate
+            )
+        )
+    else:
+        timing = dict(rate=sampling_rate, starting_time=0.0)
+
     # Electrical Series
     ephys_ts = ElectricalSeries(
-        name=metadata['Ecephys']['ElectricalSeries'][0]['name'],
-        description=metadata['Ecephys']['ElectricalSeries'][0]['description'],
-        data=data_iter,
+        name=meta_es['name'],
+        description=meta_es['description'],
+        data=wrap_data_io(data_iter, data_io),
         electrodes=electrode_table_region,
-        rate=sampling_rate,
-        starting_time=0.0,
-        conversion=es_conversion_factor
+        conversion=es_conversion_factor,
+        **timing
     )
     nwbfile.add_acquisition(ephys_ts)
 
     return nwbfile
+
+
+def make_notch(sampling_rate, notch_frequency):
+    """Notch filter for (time x channel) blocks, None if notch_frequency is 0."""
+    if notch_frequency > 0:
+        return NotchFilter(sampling_rate, notch_frequency, 10, axis=0)
+    return None
@@ -1,92 +1,60 @@
+from pynwb import TimeSeries
 from pynwb.ophys import OpticalChannel
 from pynwb.device import Device
 from ndx_fret import FRET, FRETSeries
-from hdmf.data_utils import DataChunkIterator
-from jaeger_lab_to_nwb.resources.create_nwbfile import create_nwbfile
+from jaeger_lab_to_nwb.resources.create_nwbfile import create_nwbfile, matches_session_start_time
+from jaeger_lab_to_nwb.resources.data_iterators import RSDDataChunkIterator, RSDAnalogSource, RSDAnalogChunkIterator
+from jaeger_lab_to_nwb.resources.parallel import PrefetchHub
+from jaeger_lab_to_nwb.resources.read_rsd import read_rsd_channels, RSD_ANALOG_ROWS, RSD_ANALOG_SAMPLES_PER_FRAME
+from jaeger_lab_to_nwb.resources.session_index import index_rsh_session
+from jaeger_lab_to_nwb.resources.data_io import data_io_settings, wrap_data_io
 
 from datetime import datetime
-from pathlib import Path
-import numpy as np
-import struct
 import copy
 import os
 
 
-def read_trial_meta(trial_meta):
-    """Opens trial_meta file and read line by line."""
-    files_raw = []
-    addftolist = False
-    with open(trial_meta, "r") as f:
-        line = f.readline()
-        while line:
-            if 'acquisition_date' in line:
-                acquisition_date = line.replace('acquisition_date', '').replace('=', '').strip()
-            if 'sample_time' in line:
-                aux = line.replace('sample_time', '').replace('=', '').replace('msec', '').strip()
-                sample_time = float(aux) / 1000.
-                sample_rate = 1 / sample_time
-            if 'page_frames' in line:
-                aux = line.replace('page_frames', '').replace('=', '').strip()
-                n_frames = int(aux)
-            if addftolist:
-                files_raw.append(line.strip())
-            if 'Data-File-List' in line:
-                addftolist = True   # indicates that next lines are file names to be added
-            line = f.readline()
-
-    # Separate .rsm file (bitmap of monitor) from .rsd files (raw data)
-    file_rsm = files_raw[0]
-    files_raw = files_raw[1:]
-    return file_rsm, files_raw, acquisition_date, sample_rate, n_frames
-
-
-def add_ophys_rsd(nwbfile, metadata, dir_cortical_imaging):
+def add_ophys_rsd(nwbfile, metadata, dir_cortical_imaging, n_workers=0, max_prefetch=None, data_io=None):
     """
     Reads optophysiology raw data from .rsd files and adds it to nwbfile.
     XXXXXXX_A.rsd - Raw data from donor
     XXXXXXX_B.rsd - Raw data from acceptor
     XXXXXXXXX.rsh - Header data
+
+    If n_workers > 0, both channels of each trial are decoded in a process pool and
+    written in trial order, holding at most max_prefetch decoded trials in memory.
+
+    data_io sets the HDF5 chunking and compression of frames and analog channels, see
+    data_io.data_io_settings. If None, they are set by the 'DataIO' section of metadata,
+    or default to gzip compression (level 4, with shuffle).
+    """
+    parsed = parse_ophys_rsd(dir_cortical_imaging)
+    return attach_ophys_rsd(nwbfile, metadata, parsed, n_workers=n_workers, max_prefetch=max_prefetch,
+                            data_io=data_io)
+
+
+def parse_ophys_rsd(dir_cortical_imaging):
+    """
+    Parse phase of add_ophys_rsd: indexes the .rsh headers of all trials and gets the
+    session start time, without touching any nwbfile.
     """
-    def data_gen(channel, trial):
-        """channel = 'A' or 'B'"""
-        # Read trial-specific metadata file .rsh
-        trial_meta = os.path.join(dir_cortical_imaging, "VSFP_01A0801-" + trial + "_" + channel + ".rsh")
-        file_rsm, files_raw, acquisition_date, sample_rate, n_frames = read_trial_meta(trial_meta=trial_meta)
-
-        # Iterates over all files within the same trial
-        for fn, fraw in enumerate(files_raw):
-            print('adding channel ' + channel + ', trial: ', trial, ': ', 100 * fn / len(files_raw), '%')
-            fpath = os.path.join(dir_cortical_imaging, fraw)
-
-            # Open file as a byte array
-            with open(fpath, "rb") as f:
-                byte = f.read(1000000000)
-            # Data as word array: 'h' signed, 'H' unsigned
-            words = np.array(struct.unpack('h' * (len(byte) // 2), byte))
-
-            # Iterates over frames within the same file (n_frames, 100, 100)
-            n_frames = int(len(words) / 12800)
-            words_reshaped = words.reshape(12800, n_frames, order='F')
-            frames = np.zeros((n_frames, 100, 100))
-            excess_frames = np.zeros((n_frames, 20, 100))
-            for ifr in range(n_frames):
-                iframe = -words_reshaped[:, ifr].reshape(128, 100, order='F').astype('int16')
-                frames[ifr, :, :] = iframe[20:120, :]
-                excess_frames[ifr, :, :] = iframe[0:20, :]
-
-                yield iframe[20:120, :]
-
-            #     # Analog signals are taken from excess data variable
-            #     analog_1 = np.squeeze(np.squeeze(excess_frames[:, 12, 0:80:4]).reshape(20*256, 1))
-            #     analog_2 = np.squeeze(np.squeeze(excess_frames[:, 14, 0:80:4]).reshape(20*256, 1))
-            #     stim_trg = np.squeeze(np.squeeze(excess_frames[:, 8, 0:80:4]).reshape(20*256, 1))
+    # Parsed .rsh headers of all trials, from the session index
+    index = index_rsh_session(source_dir=dir_cortical_imaging)
 
     # Get session_start_time from first header file
-    all_files = os.listdir(dir_cortical_imaging)
-    all_headers = [f for f in all_files if ('.rsh' in f) and ('_A' not in f) and ('_B' not in f)]
-    all_headers.sort()
-    _, _, acquisition_date, _, _ = read_trial_meta(trial_meta=Path(dir_cortical_imaging) / all_headers[0])
+    acquisition_date = index['trials'][0]['header']['acquisition_date']
     session_start_time = datetime.strptime(acquisition_date, '%Y/%m/%d %H:%M:%S')
+
+    return {'source_dir': dir_cortical_imaging, 'index': index, 'session_start_time': session_start_time}
+
+
+def attach_ophys_rsd(nwbfile, metadata, parsed, n_workers=0, max_prefetch=None, data_io=None):
+    """Attach phase of add_ophys_rsd: adds the output of parse_ophys_rsd to nwbfile."""
+    if data_io is None:
+        data_io = data_io_settings(metadata, 'Ophys')
+    dir_cortical_imaging = parsed['source_dir']
+    index = parsed['index']
+    session_start_time = parsed['session_start_time']
     print(session_start_time)
 
     # Get initial metadata
@@ -95,7 +63,7 @@ def add_ophys_rsd(nwbfile, metadata, dir_cortical_imaging):
         meta_init['NWBFile']['session_start_time'] = session_start_time
         nwbfile = create_nwbfile(meta_init)
     else:
-        if session_start_time != nwbfile.session_start_time:
+        if not matches_session_start_time(nwbfile, session_start_time):
             print("Session start time in current nwbfile does not match the start time from rsd files.")
             print("Ophys data conversion aborted.")
             return nwbfile
@@ -127,14 +95,29 @@ def add_ophys_rsd(nwbfile, metadata, dir_cortical_imaging):
     else:
         add_trials = True
 
+    # Decodes donor and acceptor of each trial in worker processes, in trial order
+    hub = None
+    if n_workers > 0:
+        trials_files = [
+            [[os.path.join(dir_cortical_imaging, fraw) for fraw in trial[channel]['files_raw']] for channel in ['A', 'B']]
+            for trial in index['trials']
+        ]
+        hub = PrefetchHub(
+            func=read_rsd_channels,
+            items=trials_files,
+            n_consumers=2,
+            n_workers=n_workers,
+            max_prefetch=max_prefetch
+        )
+
     # Iterate over trials, creates a FRET group per trial
-    trials_numbers = [f.split('-')[1].replace('.rsh', '') for f in all_headers]
-    for tr in trials_numbers:
-        # Read trial-specific metadata file .rsh
-        trial_meta_A = os.path.join(dir_cortical_imaging, "VSFP_01A0801-" + tr + "_A.rsh")
-        trial_meta_B = os.path.join(dir_cortical_imaging, "VSFP_01A0801-" + tr + "_B.rsh")
-        file_rsm_A, files_raw_A, acquisition_date_A, sample_rate_A, n_frames_A = read_trial_meta(trial_meta=trial_meta_A)
-        file_rsm_B, files_raw_B, acquisition_date_B, sample_rate_B, n_frames_B = read_trial_meta(trial_meta=trial_meta_B)
+    for ii, trial in enumerate(index['trials']):
+        tr = trial['trial']
+        rec_A, rec_B = trial['A'], trial['B']
+        files_raw_A, acquisition_date_A, sample_rate_A, n_frames_A = \
+            rec_A['files_raw'], rec_A['acquisition_date'], rec_A['sample_rate'], rec_A['n_frames']
+        files_raw_B, acquisition_date_B, sample_rate_B, n_frames_B = \
+            rec_B['files_raw'], rec_B['acquisition_date'], rec_B['sample_rate'], rec_B['n_frames']
 
         absolute_start_time = datetime.strptime(acquisition_date_A, '%Y/%m/%d %H:%M:%S')
         relative_start_time = float((absolute_start_time - nwbfile.session_start_time.replace(tzinfo=None)).seconds)
@@ -149,19 +132,23 @@ def add_ophys_rsd(nwbfile, metadata, dir_cortical_imaging):
         assert relative_start_time >= 0., \
             "Starting time is negative. Trial=" + str(tr)
 
-        # Create iterator
-        data_donor = DataChunkIterator(
-            data=data_gen(channel='A', trial=tr),
-            iter_axis=0,
-            buffer_size=10000,
-            maxshape=(None, 100, 100)
+        # Create iterators, analog channels are decoded with the donor frames
+        analog_source = RSDAnalogSource(files=[os.path.join(dir_cortical_imaging, fraw) for fraw in files_raw_A])
+        data_donor = RSDDataChunkIterator(
+            files=[os.path.join(dir_cortical_imaging, fraw) for fraw in files_raw_A],
+            description='channel A, trial ' + tr,
+            hub=hub,
+            hub_item=(ii, 0),
+            analog=analog_source
         )
-        data_acceptor = DataChunkIterator(
-            data=data_gen(channel='B', trial=tr),
-            iter_axis=0,
-            buffer_size=10000,
-            maxshape=(None, 100, 100)
+        data_acceptor = RSDDataChunkIterator(
+            files=[os.path.join(dir_cortical_imaging, fraw) for fraw in files_raw_B],
+            description='channel B, trial ' + tr,
+            hub=hub,
+            hub_item=(ii, 1)
         )
+        if data_donor.n_frames != n_frames_A or data_acceptor.n_frames != n_frames_B:
+            print('Number of frames in rsd files does not match page_frames in rsh files. Trial=' + str(tr))
 
         # FRETSeries
         frets_donor = FRETSeries(
@@ -170,7 +157,7 @@ def add_ophys_rsd(nwbfile, metadata, dir_cortical_imaging):
             optical_channel=opt_ch_donor,
             device=device,
             description=meta_donor['description'],
-            data=data_donor,
+            data=wrap_data_io(data_donor, data_io),
             starting_time=relative_start_time,
             rate=sample_rate_A,
             unit=meta_donor['unit'],
@@ -181,7 +168,7 @@ def add_ophys_rsd(nwbfile, metadata, dir_cortical_imaging):
             optical_channel=opt_ch_acceptor,
             device=device,
             description=meta_acceptor['description'],
-            data=data_acceptor,
+            data=wrap_data_io(data_acceptor, data_io),
             starting_time=relative_start_time,
             rate=sample_rate_B,
             unit=meta_acceptor['unit']
@@ -197,6 +184,29 @@ def add_ophys_rsd(nwbfile, metadata, dir_cortical_imaging):
         )
         nwbfile.add_acquisition(fret)
 
+        # Adds analog channels from the excess rows of frames, after FRET so that
+        # they are written once the frames have been decoded
+        analog_rate = sample_rate_A * RSD_ANALOG_SAMPLES_PER_FRAME
+        for column, (analog_name, row) in enumerate(RSD_ANALOG_ROWS.items()):
+            nwbfile.add_acquisition(TimeSeries(
+                name=analog_name + '_' + str(tr),
+                description='Analog channel from row ' + str(row) + ' of the donor raw frames.',
+                data=wrap_data_io(RSDAnalogChunkIterator(source=analog_source, column=column), data_io),
+                starting_time=relative_start_time,
+                rate=analog_rate,
+                unit='n/a'
+            ))
+        stim_column = list(RSD_ANALOG_ROWS).index('stim_trigger')
+        nwbfile.add_acquisition(TimeSeries(
+            name='stim_trigger_events_' + str(tr),
+            description='Onsets of the stimulus trigger: its value and time at each upward '
+                        'crossing of the midpoint between its minimum and maximum.',
+            data=RSDAnalogChunkIterator(source=analog_source, column=stim_column, events='data'),
+            timestamps=RSDAnalogChunkIterator(source=analog_source, column=stim_column, events='timestamps',
+                                              starting_time=relative_start_time, rate=analog_rate),
+            unit='n/a'
+        ))
+
         # Adds trial
         if add_trials:
             tr_stop = relative_start_time + n_frames_A / sample_rate_A
@@ -14,3 +14,14 @@ def create_nwbfile(metadata):
         nwbfile.subject = experiment_subject
 
     return nwbfile
+
+
+def matches_session_start_time(nwbfile, session_start_time):
+    """
+    Whether session_start_time matches that of nwbfile. Naive datetimes from source
+    files are compared by wall clock time, as NWBFile sets their timezone as local.
+    """
+    nwb_start_time = nwbfile.session_start_time
+    if session_start_time.tzinfo is None:
+        nwb_start_time = nwb_start_time.replace(tzinfo=None)
+    return session_start_time == nwb_start_time
@@ -0,0 +1,78 @@
+from pynwb import H5DataIO
+import numpy as np
+import copy
+
+# Default HDF5 storage of the large datasets of each modality, overridden by the
+# 'DataIO' section of the metadata, e.g.:
+# DataIO:
+#   Ecephys:
+#     compression: lzf
+#     chunk_samples: 30000
+DEFAULT_DATA_IO = {
+    'Ecephys': {'compression': 'gzip', 'compression_opts': 4, 'shuffle': True, 'chunk_samples': None},
+    'Ophys': {'compression': 'gzip', 'compression_opts': 4, 'shuffle': True, 'chunk_samples': None},
+}
+
+# Target size of chunks, when their number of samples is not set
+CHUNK_BYTES = 2 ** 20
+
+
+def data_io_settings(metadata, modality, **overrides):
+    """
+    HDF5 storage settings of a modality: defaults, updated by metadata['DataIO'][modality]
+    and by the overrides that are not None (e.g. from the command line).
+
+    Settings are 'compression' ('gzip', 'lzf' or None), 'compression_opts' (gzip level),
+    'shuffle' and 'chunk_samples' (chunk length along time, None for ~1 MB chunks).
+    """
+    settings = copy.deepcopy(DEFAULT_DATA_IO[modality])
+    settings.update(metadata.get('DataIO', dict()).get(modality, dict()) or dict())
+    settings.update({k: v for k, v in overrides.items() if v is not None})
+    if settings['compression'] in ['none', 'None']:
+        settings['compression'] = None
+    if settings['compression'] != 'gzip':
+        settings['compression_opts'] = None
+    return settings
+
+
+def time_chunks(maxshape, dtype, chunk_samples=None):
+    """
+    Chunk shape for time-major reads: chunk_samples along time (first axis) and the
+    full extent of the other axes. If chunk_samples is None, chunks hold about
+    CHUNK_BYTES. Returns None for empty datasets.
+    """
+    if maxshape[0] == 0:
+        return None
+    if chunk_samples is None:
+        sample_bytes = np.dtype(dtype).itemsize * int(np.prod(maxshape[1:]))
+        chunk_samples = max(1, CHUNK_BYTES // sample_bytes)
+    return (int(min(chunk_samples, maxshape[0])),) + tuple(maxshape[1:])
+
+
+def wrap_data_io(data, settings, maxshape=None, dtype=None):
+    """
+    Wraps data in H5DataIO with the chunking and compression of settings, see
+    data_io_settings. Returns data unchanged if settings is None.
+
+    Chunks follow the data iterator recommended_chunk_shape, if any, so that chunks
+    are written whole. Otherwise they are set by time_chunks, for which maxshape and
+    dtype default to those of data.
+    """
+    if settings is None:
+        return data
+    chunks = None
+    if settings.get('chunk_samples') is None and hasattr(data, 'recommended_chunk_shape'):
+        chunks = data.recommended_chunk_shape()
+    if chunks is None:
+        maxshape = maxshape if maxshape is not None else data.maxshape
+        dtype = dtype if dtype is not None else data.dtype
+        chunks = time_chunks(maxshape, dtype, settings.get('chunk_samples'))
+    if chunks is None:
+        return data
+    return H5DataIO(
+        data=data,
+        chunks=chunks,
+        compression=settings['compression'],
+        compression_opts=settings['compression_opts'],
+        shuffle=bool(settings['shuffle']) if settings['compression'] is not None else False,
+    )
@@ -0,0 +1,417 @@
+from hdmf.data_utils import AbstractDataChunkIterator, DataChunk
+from jaeger_lab_to_nwb.resources.load_intan.rhd_file import RHDFile
+from jaeger_lab_to_nwb.resources.parallel import prefetch_map
+from jaeger_lab_to_nwb.resources.session_index import rhd_file_valid_segments
+from jaeger_lab_to_nwb.resources.read_rsd import (read_rsd_file, decode_rsd_frames, decode_rsd_analog, rsd_file_n_frames,
+                                                  trigger_onsets, RSD_IMAGE_SHAPE, RSD_ANALOG_ROWS,
+                                                  RSD_ANALOG_SAMPLES_PER_FRAME)
+
+import numpy as np
+
+
+def read_rhd_segments(fname, segments, native_dtypes=False):
+    """Reads the amplifier samples of segments of a .rhd file, as one (time x channel) array."""
+    with RHDFile(fname, native_dtypes=native_dtypes) as rhd:
+        pieces = [rhd.amplifier_data[:, seg[0]:seg[1]].T for seg in segments]
+        if len(pieces) == 0:
+            return np.zeros((0, rhd.amplifier_data.shape[0]), dtype=rhd.amplifier_data[:, 0:0].dtype)
+        return np.ascontiguousarray(np.concatenate(pieces, axis=0))
+
+
+def _read_rhd_file_segments(file_segments, native_dtypes=False):
+    """Unpacks a (file, segments) item for read_rhd_segments, in worker processes."""
+    fname, segments = file_segments
+    return read_rhd_segments(fname, segments, native_dtypes=native_dtypes)
+
+
+class RHDDataChunkIterator(AbstractDataChunkIterator):
+    """
+    Iterates over the amplifier data of a sequence of .rhd files, in (time x channel) blocks.
+
+    Only samples within the given segments of each file are kept. By default, these are
+    the samples flagged as valid by the first board digital input channel. Segments are
+    known when the iterator is created, so the full shape of the dataset is known before
+    writing starts.
+
+    Parameters
+    ----------
+    files : list
+        Paths to .rhd files, in temporal order.
+    blocks_per_chunk : int
+        Number of RHD data blocks (60 or 128 samples each) read from file at each iteration.
+    native_dtypes : bool
+        If True, amplifier data is yielded as int16 instead of int32.
+    n_workers : int
+        Number of worker processes decoding the next files while the current one is
+        written. If 0, files are decoded in the main process, window by window.
+    max_prefetch : int
+        Maximum number of decoded files waiting to be written. Defaults to n_workers.
+    file_segments : list
+        For each file, a list of [start, stop, ...] sample ranges to be written, e.g.
+        from session_index.rhd_valid_segments.
+    notch : NotchFilter
+        Filter applied to each (time x channel) block before it is written, with
+        axis=0. Its state is carried across blocks and files.
+    """
+
+    def __init__(self, files, blocks_per_chunk=1000, native_dtypes=False, n_workers=0, max_prefetch=None,
+                 file_segments=None, notch=None):
+        self.files = files
+        self.blocks_per_chunk = blocks_per_chunk
+        self.native_dtypes = native_dtypes
+        self.n_workers = n_workers
+        self.max_prefetch = max_prefetch
+        self.notch = notch
+
+        with RHDFile(files[0], native_dtypes=native_dtypes) as rhd:
+            self.n_channels = rhd.header['num_amplifier_channels']
+            self._samples_per_block = rhd.header['num_samples_per_data_block']
+            self._dtype = rhd.amplifier_data[:, 0:0].dtype
+
+        # Finds valid segments of each file
+        if file_segments is None:
+            file_segments = [rhd_file_valid_segments(fname, blocks_per_chunk) for fname in files]
+        self.file_segments = file_segments
+        self.file_n_samples = [sum([seg[1] - seg[0] for seg in segments]) for segments in file_segments]
+        self.n_samples = sum(self.file_n_samples)
+
+        self._chunks = self._chunks_gen()
+        self._position = 0
+
+    def _chunks_gen(self):
+        if self.n_workers > 0:
+            return self._prefetched_chunks_gen()
+        return self._windowed_chunks_gen()
+
+    def _prefetched_chunks_gen(self):
+        n_files = len(self.files)
+        decoded_files = prefetch_map(
+            func=_read_rhd_file_segments,
+            items=zip(self.files, self.file_segments),
+            n_workers=self.n_workers,
+            max_prefetch=self.max_prefetch,
+            native_dtypes=self.native_dtypes
+        )
+        # Iterates over decoded files, in the same order as self.files
+        samples_per_chunk = self.blocks_per_chunk * self._samples_per_block
+        for ii, analog_data in enumerate(decoded_files):
+            print("Converting ecephys rhd data: {}%".format(100 * ii / n_files))
+            for start in range(0, analog_data.shape[0], samples_per_chunk):
+                yield analog_data[start:start + samples_per_chunk]
+
+    def _windowed_chunks_gen(self):
+        n_files = len(self.files)
+        samples_per_chunk = self.blocks_per_chunk * self._samples_per_block
+        # Iterates over all files
+        for ii, (fname, segments) in enumerate(zip(self.files, self.file_segments)):
+            print("Converting ecephys rhd data: {}%".format(100 * ii / n_files))
+            with RHDFile(fname, native_dtypes=self.native_dtypes) as rhd:
+                # Reads each segment in windows of at most samples_per_chunk samples
+                for seg in segments:
+                    for start in range(seg[0], seg[1], samples_per_chunk):
+                        stop = min(start + samples_per_chunk, seg[1])
+                        yield np.ascontiguousarray(rhd.amplifier_data[:, start:stop].T)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        data = next(self._chunks)
+        if self.notch is not None:
+            data = self.notch.apply(data)
+        selection = np.s_[self._position:self._position + data.shape[0], :]
+        self._position += data.shape[0]
+        return DataChunk(data=data, selection=selection)
+
+    next = __next__
+
+    def recommended_chunk_shape(self):
+        return None
+
+    def recommended_data_shape(self):
+        return self.maxshape
+
+    @property
+    def dtype(self):
+        return self._dtype
+
+    @property
+    def maxshape(self):
+        return (self.n_samples, self.n_channels)
+
+
+class TimestampsChunkIterator(AbstractDataChunkIterator):
+    """
+    Iterates over the timestamps of uniformly sampled segments, in blocks.
+
+    Timestamps are generated from each segment's starting time and the sampling rate,
+    so explicit timestamps can be written without holding them all in memory.
+
+    Parameters
+    ----------
+    starting_times : list
+        Starting time (in seconds) of each segment.
+    n_samples : list
+        Number of samples of each segment.
+    rate : float
+        Sampling rate, in Hz.
+    samples_per_chunk : int
+        Maximum number of timestamps yielded at each iteration.
+    """
+
+    def __init__(self, starting_times, n_samples, rate, samples_per_chunk=1000000):
+        self.starting_times = starting_times
+        self.n_samples = n_samples
+        self.rate = rate
+        self.samples_per_chunk = samples_per_chunk
+        self._chunks = self._chunks_gen()
+        self._position = 0
+
+    def _chunks_gen(self):
+        for starting_time, n_samples in zip(self.starting_times, self.n_samples):
+            for start in range(0, n_samples, self.samples_per_chunk):
+                stop = min(start + self.samples_per_chunk, n_samples)
+                yield starting_time + np.arange(start, stop) / self.rate
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        data = next(self._chunks)
+        selection = np.s_[self._position:self._position + data.shape[0]]
+        self._position += data.shape[0]
+        return DataChunk(data=data, selection=selection)
+
+    next = __next__
+
+    def recommended_chunk_shape(self):
+        return None
+
+    def recommended_data_shape(self):
+        return self.maxshape
+
+    @property
+    def dtype(self):
+        return np.dtype('float64')
+
+    @property
+    def maxshape(self):
+        return (sum(self.n_samples),)
+
+
+class RSDDataChunkIterator(AbstractDataChunkIterator):
+    """
+    Iterates over the image frames of a sequence of .rsd files, in blocks of frames.
+
+    Blocks have the size of the recommended HDF5 chunk, including across file
+    boundaries, and are decoded from memory-mapped files only when requested. The
+    total number of frames is known from the file sizes before writing starts.
+
+    Parameters
+    ----------
+    files : list
+        Paths to .rsd files of one channel of a trial, in temporal order.
+    frames_per_chunk : int
+        Number of (100 x 100) frames per block, and per HDF5 chunk.
+    description : str
+        Label used in progress messages, e.g. 'channel A, trial 001'.
+    hub : PrefetchHub
+        If given, frames are taken from the hub, where they are decoded in worker
+        processes with read_rsd_channels, instead of from files in this process.
+    hub_item : tuple
+        (index, channel) of this iterator's frames in the hub results.
+    analog : RSDAnalogSource
+        If given, the analog channels of the excess rows are decoded in the same pass
+        as the frames and handed to it.
+    """
+
+    def __init__(self, files, frames_per_chunk=32, description='', hub=None, hub_item=None, analog=None):
+        self.files = files
+        self.frames_per_chunk = frames_per_chunk
+        self.description = description
+        self.hub = hub
+        self.hub_item = hub_item
+        self.analog = analog
+        self.file_n_frames = [rsd_file_n_frames(fpath) for fpath in files]
+        self.n_frames = sum(self.file_n_frames)
+        self._chunks = self._chunks_gen()
+        self._position = 0
+
+    def _chunks_gen(self):
+        if self.hub is not None:
+            return self._hub_chunks_gen()
+        return self._files_chunks_gen()
+
+    def _hub_chunks_gen(self):
+        index, channel = self.hub_item
+        frames, analog = self.hub.get(index)[channel]
+        if self.analog is not None:
+            self.analog.add(analog)
+            self.analog.finish()
+        print('adding ' + self.description)
+        for start in range(0, frames.shape[0], self.frames_per_chunk):
+            yield frames[start:start + self.frames_per_chunk]
+        self.hub.release(index)
+
+    def _files_chunks_gen(self):
+        n_files = len(self.files)
+        pending = []
+        n_pending = 0
+        for ii, fpath in enumerate(self.files):
+            print('adding ' + self.description + ': ', 100 * ii / n_files, '%')
+            raw = read_rsd_file(fpath)
+            start = 0
+            # Fills blocks of frames_per_chunk frames, carrying the remainder to the next file
+            while start < raw.shape[0]:
+                stop = min(start + self.frames_per_chunk - n_pending, raw.shape[0])
+                pending.append(decode_rsd_frames(raw[start:stop]))
+                if self.analog is not None:
+                    self.analog.add(decode_rsd_analog(raw[start:stop]))
+                n_pending += stop - start
+                start = stop
+                if n_pending == self.frames_per_chunk:
+                    yield np.concatenate(pending, axis=0)
+                    pending = []
+                    n_pending = 0
+        if self.analog is not None:
+            self.analog.finish()
+        if n_pending > 0:
+            yield np.concatenate(pending, axis=0)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        data = next(self._chunks)
+        selection = np.s_[self._position:self._position + data.shape[0], :, :]
+        self._position += data.shape[0]
+        return DataChunk(data=data, selection=selection)
+
+    next = __next__
+
+    def recommended_chunk_shape(self):
+        if self.n_frames == 0:
+            return None
+        return (min(self.frames_per_chunk, self.n_frames),) + RSD_IMAGE_SHAPE
+
+    def recommended_data_shape(self):
+        return self.maxshape
+
+    @property
+    def dtype(self):
+        return np.dtype('int16')
+
+    @property
+    def maxshape(self):
+        return (self.n_frames,) + RSD_IMAGE_SHAPE
+
+
+class RSDAnalogSource:
+    """
+    Analog channels of the excess rows of the .rsd files of one channel of a trial.
+
+    They are decoded by the RSDDataChunkIterator of the same files, in the same pass
+    as the image frames, and read from here by the TimeSeries iterators. If these are
+    written before the image frames, the excess rows are decoded from files instead.
+
+    Parameters
+    ----------
+    files : list
+        Paths to .rsd files of one channel of a trial, in temporal order.
+    """
+
+    def __init__(self, files):
+        self.files = files
+        self.n_samples = sum([rsd_file_n_frames(fpath) for fpath in files]) * RSD_ANALOG_SAMPLES_PER_FRAME
+        self.complete = False
+        self._pieces = []
+        self.data = None
+
+    def add(self, analog):
+        """Appends the analog samples of the next decoded frames."""
+        if not self.complete:
+            self._pieces.append(analog)
+
+    def finish(self):
+        """Marks all frames as decoded."""
+        if not self.complete:
+            self.data = np.concatenate(self._pieces + [np.zeros((0, len(RSD_ANALOG_ROWS)), dtype='<i2')], axis=0)
+            self._pieces = []
+            self.complete = True
+
+    def get_data(self):
+        """(n_samples, 3) int16 array of analog channels, in the order of RSD_ANALOG_ROWS."""
+        if not self.complete:
+            self._pieces = [decode_rsd_analog(read_rsd_file(fpath)) for fpath in self.files]
+            self.finish()
+        return self.data
+
+
+class RSDAnalogChunkIterator(AbstractDataChunkIterator):
+    """
+    Iterates over one analog channel of an RSDAnalogSource, or over its onset events.
+
+    Parameters
+    ----------
+    source : RSDAnalogSource
+        Analog channels of a trial.
+    column : int
+        Column of the channel in the source data, in the order of RSD_ANALOG_ROWS.
+    events : str
+        If None, the channel samples are yielded. If 'timestamps' or 'data', the times
+        (starting_time + sample / rate) or the samples at the channel onsets are yielded
+        (see read_rsd.trigger_onsets), whose number is only known after decoding.
+    starting_time : float
+        Time of the first sample, in seconds, for events='timestamps'.
+    rate : float
+        Sampling rate of the analog channel, in Hz, for events='timestamps'.
+    """
+
+    def __init__(self, source, column, events=None, starting_time=0., rate=1.):
+        self.source = source
+        self.column = column
+        self.events = events
+        self.starting_time = starting_time
+        self.rate = rate
+        self._done = False
+
+    def _get_data(self):
+        channel = self.source.get_data()[:, self.column]
+        if self.events is None:
+            return channel
+        onsets = trigger_onsets(channel)
+        if self.events == 'timestamps':
+            return self.starting_time + onsets / self.rate
+        return channel[onsets]
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._done:
+            raise StopIteration
+        self._done = True
+        data = self._get_data()
+        return DataChunk(data=data, selection=np.s_[0:data.shape[0]])
+
+    next = __next__
+
+    def recommended_chunk_shape(self):
+        return None
+
+    def recommended_data_shape(self):
+        if self.events is None:
+            return self.maxshape
+        return (0,)
+
+    @property
+    def dtype(self):
+        if self.events == 'timestamps':
+            return np.dtype('float64')
+        return np.dtype('int16')
+
+    @property
+    def maxshape(self):
+        if self.events is None:
+            return (self.source.n_samples,)
+        return (None,)
@@ -6,8 +6,11 @@
 # ------------------------------------------------------------------------------
 
 
-def data_to_result(header, data, data_present):
-    """Moves the header and data (if present) into a common object."""
+def data_to_result(header, data, data_present, include_raw=False):
+    """Moves the header and data (if present) into a common object.
+
+    If include_raw is True, the raw digital input and output words are moved as well.
+    """
 
     result = {}
     if header['num_amplifier_channels'] > 0 and data_present:
@@ -56,11 +59,21 @@ def data_to_result(header, data, data_present):
     if header['num_board_dig_in_channels'] > 0:
         result['board_dig_in_channels'] = header['board_dig_in_channels']
         if data_present:
-            result['board_dig_in_data'] = data['board_dig_in_data']
+            if 'board_dig_in_edges' in data:
+                result['board_dig_in_edges'] = data['board_dig_in_edges']
+            else:
+                result['board_dig_in_data'] = data['board_dig_in_data']
+            if include_raw:
+                result['board_dig_in_raw'] = data['board_dig_in_raw']
 
     if header['num_board_dig_out_channels'] > 0:
         result['board_dig_out_channels'] = header['board_dig_out_channels']
         if data_present:
-            result['board_dig_out_data'] = data['board_dig_out_data']
+            if 'board_dig_out_edges' in data:
+                result['board_dig_out_edges'] = data['board_dig_out_edges']
+            else:
+                result['board_dig_out_data'] = data['board_dig_out_data']
+            if include_raw:
+                result['board_dig_out_raw'] = data['board_dig_out_raw']
 
     return result
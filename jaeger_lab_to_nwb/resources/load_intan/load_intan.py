@@ -12,15 +12,29 @@ import numpy as np
 
 from .read_header import read_header
 from .get_bytes_per_data_block import get_bytes_per_data_block
-from .read_one_data_block import read_one_data_block
-# from .notch_filter import notch_filter
+from .read_data_blocks import read_data_blocks
+from .scale_data import (AMPLIFIER_DATA_CONVERSION_FACTOR, scale_amplifier_data, scale_aux_input_data,
+                         scale_supply_voltage_data, scale_board_adc_data, scale_temp_sensor_data,
+                         scale_timestamps, extract_digital_channels, extract_digital_edges)
+from .notch_filter import NotchFilter
 from .data_to_result import data_to_result
 
 
-def read_data(filename, print_details=False):
+def read_data(filename, print_details=False, native_dtypes=False, digital_edges=False, apply_notch=False):
     """Reads Intan Technologies RHD2000 data file generated by evaluation board GUI.
 
     Data are returned in a dictionary, for future extensibility.
+
+    With native_dtypes=True, streams keep their native widths: amplifier data as
+    int16 (amplifier_data_conversion_factor still converts it to Volts), analog
+    streams as float32, and the raw uint16 digital words are returned as well.
+
+    With digital_edges=True, board digital inputs and outputs are returned as the
+    sample indices of their rising and falling edges (board_dig_in_edges,
+    board_dig_out_edges) instead of dense boolean arrays.
+
+    With apply_notch=True, the notch filter selected during the recording (if any)
+    is applied to amplifier data, which keeps its integer dtype.
     """
 
     tic = time.time()
@@ -54,11 +68,6 @@ def read_data(filename, print_details=False):
     num_data_blocks = int(bytes_remaining / bytes_per_block)
 
     num_amplifier_samples = header['num_samples_per_data_block'] * num_data_blocks
-    num_aux_input_samples = int((header['num_samples_per_data_block'] / 4) * num_data_blocks)
-    num_supply_voltage_samples = 1 * num_data_blocks
-    num_board_adc_samples = header['num_samples_per_data_block'] * num_data_blocks
-    num_board_dig_in_samples = header['num_samples_per_data_block'] * num_data_blocks
-    num_board_dig_out_samples = header['num_samples_per_data_block'] * num_data_blocks
 
     record_time = num_amplifier_samples / header['sample_rate']
 
@@ -69,65 +78,12 @@ def read_data(filename, print_details=False):
             print('Header file contains no data.  Amplifiers were sampled at {:0.2f} kS/s.'.format(header['sample_rate'] / 1000))
 
     if data_present:
-        # Pre-allocate memory for data.
+        # Read sampled data from file, all data blocks at once.
         if print_details:
             print('')
-            print('Allocating memory for data...')
-
-        data = {}
-        if (header['version']['major'] == 1 and header['version']['minor'] >= 2) or (header['version']['major'] > 1):
-            data['t_amplifier'] = np.zeros(num_amplifier_samples, dtype=np.int)
-        else:
-            data['t_amplifier'] = np.zeros(num_amplifier_samples, dtype=np.uint)
-
-        data['amplifier_data'] = np.zeros([header['num_amplifier_channels'], num_amplifier_samples], dtype=np.uint)
-        data['aux_input_data'] = np.zeros([header['num_aux_input_channels'], num_aux_input_samples], dtype=np.uint)
-        data['supply_voltage_data'] = np.zeros([header['num_supply_voltage_channels'], num_supply_voltage_samples], dtype=np.uint)
-        data['temp_sensor_data'] = np.zeros([header['num_temp_sensor_channels'], num_supply_voltage_samples], dtype=np.uint)
-        data['board_adc_data'] = np.zeros([header['num_board_adc_channels'], num_board_adc_samples], dtype=np.uint)
-
-        # by default, this script interprets digital events (digital inputs and outputs) as booleans
-        # if unsigned int values are preferred(0 for False, 1 for True), replace the 'dtype=np.bool' argument with 'dtype=np.uint' as shown
-        # the commented line below illustrates this for digital input data; the same can be done for digital out
-
-        # data['board_dig_in_data'] = np.zeros([header['num_board_dig_in_channels'], num_board_dig_in_samples], dtype=np.uint)
-        data['board_dig_in_data'] = np.zeros([header['num_board_dig_in_channels'], num_board_dig_in_samples], dtype=np.bool)
-        data['board_dig_in_raw'] = np.zeros(num_board_dig_in_samples, dtype=np.uint)
-
-        data['board_dig_out_data'] = np.zeros([header['num_board_dig_out_channels'], num_board_dig_out_samples], dtype=np.bool)
-        data['board_dig_out_raw'] = np.zeros(num_board_dig_out_samples, dtype=np.uint)
-
-        # Read sampled data from file.
-        if print_details:
             print('Reading data from file...')
 
-        # Initialize indices used in looping
-        indices = {}
-        indices['amplifier'] = 0
-        indices['aux_input'] = 0
-        indices['supply_voltage'] = 0
-        indices['board_adc'] = 0
-        indices['board_dig_in'] = 0
-        indices['board_dig_out'] = 0
-
-        print_increment = 10
-        percent_done = print_increment
-        for i in range(num_data_blocks):
-            read_one_data_block(data, header, indices, fid)
-
-            # Increment indices
-            indices['amplifier'] += header['num_samples_per_data_block']
-            indices['aux_input'] += int(header['num_samples_per_data_block'] / 4)
-            indices['supply_voltage'] += 1
-            indices['board_adc'] += header['num_samples_per_data_block']
-            indices['board_dig_in'] += header['num_samples_per_data_block']
-            indices['board_dig_out'] += header['num_samples_per_data_block']
-
-            fraction_done = 100 * (1.0 * i / num_data_blocks)
-            if fraction_done >= percent_done:
-                percent_done = percent_done + print_increment
-                if print_details:
-                    print('{}% done...'.format(percent_done))
+        data = read_data_blocks(fid, header, num_data_blocks)
 
         # Make sure we have read exactly the right amount of data.
         bytes_remaining = filesize - fid.tell()
@@ -141,31 +97,6 @@ def read_data(filename, print_details=False):
         if print_details:
             print('Parsing data...')
 
-        # Extract digital input channels to separate variables.
-        for i in range(header['num_board_dig_in_channels']):
-            data['board_dig_in_data'][i, :] = np.not_equal(np.bitwise_and(data['board_dig_in_raw'], (1 << header['board_dig_in_channels'][i]['native_order'])), 0)
-
-        # Extract digital output channels to separate variables.
-        for i in range(header['num_board_dig_out_channels']):
-            data['board_dig_out_data'][i, :] = np.not_equal(np.bitwise_and(data['board_dig_out_raw'], (1 << header['board_dig_out_channels'][i]['native_order'])), 0)
-
-        # Scale voltage levels appropriately.
-        # This line is the original (IntanTech provided) conversion to uVolts
-        # data['amplifier_data'] = np.multiply(0.195, (data['amplifier_data'].astype(np.int32) - 32768))      # units = microvolts
-        # This line modifies it, to get the data in int32 and the conversion scale to Volts
-        data['amplifier_data'] = data['amplifier_data'].astype(np.int32) - 32768  # int32 dtype
-        data['amplifier_data_conversion_factor'] = 0.195e-6  # conversion factor to Volts
-
-        data['aux_input_data'] = np.multiply(37.4e-6, data['aux_input_data'])               # units = volts
-        data['supply_voltage_data'] = np.multiply(74.8e-6, data['supply_voltage_data'])     # units = volts
-        if header['eval_board_mode'] == 1:
-            data['board_adc_data'] = np.multiply(152.59e-6, (data['board_adc_data'].astype(np.int32) - 32768))  # units = volts
-        elif header['eval_board_mode'] == 13:
-            data['board_adc_data'] = np.multiply(312.5e-6, (data['board_adc_data'].astype(np.int32) - 32768))  # units = volts
-        else:
-            data['board_adc_data'] = np.multiply(50.354e-6, data['board_adc_data'])           # units = volts
-        data['temp_sensor_data'] = np.multiply(0.01, data['temp_sensor_data'])               # units = deg C
-
         # Check for gaps in timestamps.
         num_gaps = np.sum(np.not_equal(data['t_amplifier'][1:] - data['t_amplifier'][:-1], 1))
         if print_details:
@@ -174,33 +105,20 @@ def read_data(filename, print_details=False):
             else:
                 print('Warning: {0} gaps in timestamp data found.  Time scale will not be uniform!'.format(num_gaps))
 
-        # Scale time steps (units = seconds).
-        data['t_amplifier'] = data['t_amplifier'] / header['sample_rate']
-        data['t_aux_input'] = data['t_amplifier'][range(0, len(data['t_amplifier']), 4)]
-        data['t_supply_voltage'] = data['t_amplifier'][range(0, len(data['t_amplifier']), header['num_samples_per_data_block'])]
-        data['t_board_adc'] = data['t_amplifier']
-        data['t_dig'] = data['t_amplifier']
-        data['t_temp_sensor'] = data['t_supply_voltage']
-
-        # # If the software notch filter was selected during the recording, apply the
-        # # same notch filter to amplifier data here.
-        # if header['notch_filter_frequency'] > 0:
-        #     print('Applying notch filter...')
-        #
-        #     print_increment = 10
-        #     percent_done = print_increment
-        #     for i in range(header['num_amplifier_channels']):
-        #         data['amplifier_data'][i, :] = notch_filter(data['amplifier_data'][i, :], header['sample_rate'], header['notch_filter_frequency'], 10)
-        #
-        #         fraction_done = 100 * (i / header['num_amplifier_channels'])
-        #         if fraction_done >= percent_done:
-        #             print('{}% done...'.format(percent_done))
-        #             percent_done += print_increment
+        data = parse_data(header, data, native_dtypes, digital_edges)
+
+        # If the software notch filter was selected during the recording, apply the
+        # same notch filter to amplifier data here.
+        if apply_notch and header['notch_filter_frequency'] > 0:
+            if print_details:
+                print('Applying notch filter...')
+            notch = NotchFilter(header['sample_rate'], header['notch_filter_frequency'], 10)
+            data['amplifier_data'] = notch.apply(data['amplifier_data'])
     else:
         data = []
 
     # Move variables to result struct.
-    result = data_to_result(header, data, data_present)
+    result = data_to_result(header, data, data_present, include_raw=native_dtypes)
 
     if print_details:
         print('Done!  Elapsed time: {0:0.1f} seconds'.format(time.time() - tic))
@@ -208,6 +126,77 @@ def read_data(filename, print_details=False):
     return result
 
 
+def parse_data(header, data, native_dtypes=False, digital_edges=False):
+    """Extracts digital channels and scales the raw data streams read by read_data_blocks.
+
+    Timestamps are converted to seconds and the time vectors of each stream are added.
+    If digital_edges is True, digital channels are extracted as edge sample indices.
+    """
+
+    if digital_edges:
+        # Extract rising and falling edges of digital input and output channels.
+        data['board_dig_in_edges'] = extract_digital_edges(data['board_dig_in_raw'], header['board_dig_in_channels'])
+        data['board_dig_out_edges'] = extract_digital_edges(data['board_dig_out_raw'], header['board_dig_out_channels'])
+    else:
+        # by default, this script interprets digital events (digital inputs and outputs) as booleans
+        # Extract digital input channels to separate variables.
+        data['board_dig_in_data'] = extract_digital_channels(data['board_dig_in_raw'], header['board_dig_in_channels'])
+
+        # Extract digital output channels to separate variables.
+        data['board_dig_out_data'] = extract_digital_channels(data['board_dig_out_raw'], header['board_dig_out_channels'])
+
+    # Scale voltage levels appropriately.
+    data['amplifier_data'] = scale_amplifier_data(data['amplifier_data'], native_dtypes)  # int32 or int16 dtype
+    data['amplifier_data_conversion_factor'] = AMPLIFIER_DATA_CONVERSION_FACTOR  # conversion factor to Volts
+
+    data['aux_input_data'] = scale_aux_input_data(data['aux_input_data'], native_dtypes)                  # units = volts
+    data['supply_voltage_data'] = scale_supply_voltage_data(data['supply_voltage_data'], native_dtypes)  # units = volts
+    data['board_adc_data'] = scale_board_adc_data(header, data['board_adc_data'], native_dtypes)         # units = volts
+    data['temp_sensor_data'] = scale_temp_sensor_data(data['temp_sensor_data'], native_dtypes)            # units = deg C
+
+    # Scale time steps (units = seconds).
+    data['t_amplifier'] = scale_timestamps(header, data['t_amplifier'])
+    data['t_aux_input'] = data['t_amplifier'][range(0, len(data['t_amplifier']), 4)]
+    data['t_supply_voltage'] = data['t_amplifier'][range(0, len(data['t_amplifier']), header['num_samples_per_data_block'])]
+    data['t_board_adc'] = data['t_amplifier']
+    data['t_dig'] = data['t_amplifier']
+    data['t_temp_sensor'] = data['t_supply_voltage']
+
+    return data
+
+
+def iter_blocks(filename, blocks_per_chunk=1000, native_dtypes=False, apply_notch=False):
+    """Reads Intan Technologies RHD2000 data file in chunks of blocks_per_chunk data blocks.
+
+    Yields one dictionary per chunk, with the same structure as read_data returns,
+    holding the decoded and scaled data of all streams for that chunk. Memory use is
+    set by blocks_per_chunk, regardless of file length. With apply_notch=True, the
+    notch filter state is carried from one chunk to the next.
+    """
+
+    with open(filename, 'rb') as fid:
+        filesize = os.path.getsize(filename)
+        header = read_header(fid)
+
+        bytes_per_block = get_bytes_per_data_block(header)
+        bytes_remaining = filesize - fid.tell()
+        if bytes_remaining % bytes_per_block != 0:
+            raise Exception('Something is wrong with file size : should have a whole number of data blocks')
+        num_data_blocks = int(bytes_remaining / bytes_per_block)
+
+        notch = None
+        if apply_notch and header['notch_filter_frequency'] > 0:
+            notch = NotchFilter(header['sample_rate'], header['notch_filter_frequency'], 10)
+
+        for first_block in range(0, num_data_blocks, blocks_per_chunk):
+            num_chunk_blocks = min(blocks_per_chunk, num_data_blocks - first_block)
+            data = read_data_blocks(fid, header, num_chunk_blocks)
+            data = parse_data(header, data, native_dtypes)
+            if notch is not None:
+                data['amplifier_data'] = notch.apply(data['amplifier_data'])
+            yield data_to_result(header, data, True, include_raw=native_dtypes)
+
+
 def plural(n):
     """Utility function to optionally pluralize words based on the value of n.
     """
@@ -48,3 +48,81 @@ def notch_filter(input, fSample, fNotch, Bandwidth):
         out[i] = (a*b2*input[i-2] + a*b1*input[i-1] + a*b0*input[i] - a2*out[i-2] - a1*out[i-1])/a0
 
     return out
+
+
+def notch_filter_coefficients(fSample, fNotch, Bandwidth):
+    """Numerator and denominator coefficients (b, a) of the IIR filter of notch_filter."""
+
+    tstep = 1.0/fSample
+    Fc = fNotch*tstep
+
+    d = math.exp(-2.0*math.pi*(Bandwidth/2.0)*tstep)
+    b = (1.0 + d*d) * math.cos(2.0*math.pi*Fc)
+    a = (1.0 + d*d)/2.0
+    num = np.array([a*1.0, a*(-2.0*math.cos(2.0*math.pi*Fc)), a*1.0])
+    den = np.array([1.0, -b, d*d])
+    return num, den
+
+
+class NotchFilter:
+    """Vectorized notch filter over all channels, applied chunk by chunk.
+
+    Same filter as notch_filter, run with scipy.signal.lfilter. The filter state
+    is carried from one call of apply to the next, so a recording split in blocks
+    or files is filtered as one continuous stream. As in notch_filter, the first
+    two samples of the stream are passed through unfiltered.
+
+    Parameters
+    ----------
+    fSample : float
+        Sample rate of data, in Hz.
+    fNotch : float
+        Filter notch frequency, in Hz.
+    Bandwidth : float
+        Notch 3-dB bandwidth, in Hz.
+    axis : int
+        Time axis of the chunks: -1 for (channels, samples) arrays as returned by
+        read_data, 0 for (samples, channels) arrays as written to NWB.
+    """
+
+    def __init__(self, fSample, fNotch, Bandwidth=10, axis=-1):
+        self.b, self.a = notch_filter_coefficients(fSample, fNotch, Bandwidth)
+        self.axis = axis
+        self.zi = None
+        self._head = []
+
+    def reset(self):
+        """Forgets the filter state, the next sample starts a new stream."""
+        self.zi = None
+        self._head = []
+
+    def apply(self, data):
+        """Filters the next chunk of the stream.
+
+        Integer input is rounded (and clipped) back to its dtype, so that filtered
+        amplifier samples keep their conversion factor to Volts.
+        """
+        from scipy.signal import lfilter
+
+        data = np.asarray(data)
+        x = np.moveaxis(data, self.axis, -1).astype(np.float64)
+        out = x.copy()
+
+        # Passes through the first two samples of the stream, then sets the
+        # initial state from them, as notch_filter does
+        start = 0
+        if self.zi is None:
+            start = min(2 - len(self._head), x.shape[-1])
+            self._head += [x[..., i] for i in range(start)]
+            if len(self._head) == 2:
+                (x0, x1), b, a = self._head, self.b, self.a
+                self.zi = np.stack([b[1]*x1 - a[1]*x1 + b[2]*x0 - a[2]*x0, b[2]*x1 - a[2]*x1], axis=-1)
+
+        if start < x.shape[-1]:
+            out[..., start:], self.zi = lfilter(self.b, self.a, x[..., start:], axis=-1, zi=self.zi)
+
+        out = np.moveaxis(out, -1, self.axis)
+        if np.issubdtype(data.dtype, np.integer):
+            info = np.iinfo(data.dtype)
+            out = np.clip(np.round(out), info.min, info.max).astype(data.dtype)
+        return out
@@ -3,7 +3,7 @@
 # Michael Gibson 23 April 2015
 
 
-import sys, struct, os
+import sys, struct
 
 def read_qstring(fid):
     """Read Qt style QString.  
@@ -17,25 +17,16 @@ def read_qstring(fid):
     length, = struct.unpack('<I', fid.read(4))
     if length == int('ffffffff', 16): return ""
 
-    if length > (os.fstat(fid.fileno()).st_size - fid.tell() + 1) :
+    # read the whole string (whole 16-bit Unicode words) at once,
+    # a short read means the length is past the end of file
+    data = fid.read(length - length % 2)
+    if len(data) < length - length % 2:
         print(length)
         raise Exception('Length too long.')
 
-    # convert length from bytes to 16-bit Unicode words
-    length = int(length / 2)
-
-    data = []
-    for i in range(0, length):
-        c, = struct.unpack('<H', fid.read(2))
-        data.append(c)
-
-    if sys.version_info >= (3,0):
-        a = ''.join([chr(c) for c in data])
-    else:
-        a = ''.join([unichr(c) for c in data])
-    
-    return a
-  
+    # decode 16-bit Unicode words
+    return data.decode('utf-16-le', errors='surrogatepass')
+
 if __name__ == '__main__':
     a=read_qstring(open(sys.argv[1], 'rb'))
     print(a)
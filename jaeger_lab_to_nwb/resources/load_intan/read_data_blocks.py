@@ -0,0 +1,98 @@
+#! /bin/env python
+#
+# Written for Jaeger Lab, 2020
+# Vectorized counterpart of read_one_data_block, decoding all data blocks at once.
+# ------------------------------------------------------------------------------
+
+import numpy as np
+
+from .get_bytes_per_data_block import get_bytes_per_data_block
+
+
+def get_data_block_dtype(header):
+    """Builds a structured dtype describing one 60 or 128 sample datablock.
+
+    Fields follow the same order in which read_one_data_block reads them from file,
+    streams without channels are left out.
+    """
+
+    num_samples = header['num_samples_per_data_block']
+
+    # In version 1.2, we moved from saving timestamps as unsigned
+    # integers to signed integers to accommodate negative (adjusted)
+    # timestamps for pretrigger data
+    if (header['version']['major'] == 1 and header['version']['minor'] >= 2) or (header['version']['major'] > 1):
+        fields = [('timestamps', '<i4', (num_samples,))]
+    else:
+        fields = [('timestamps', '<u4', (num_samples,))]
+
+    if header['num_amplifier_channels'] > 0:
+        fields.append(('amplifier', '<u2', (header['num_amplifier_channels'], num_samples)))
+    if header['num_aux_input_channels'] > 0:
+        fields.append(('aux_input', '<u2', (header['num_aux_input_channels'], num_samples // 4)))
+    if header['num_supply_voltage_channels'] > 0:
+        fields.append(('supply_voltage', '<u2', (header['num_supply_voltage_channels'], 1)))
+    if header['num_temp_sensor_channels'] > 0:
+        fields.append(('temp_sensor', '<u2', (header['num_temp_sensor_channels'], 1)))
+    if header['num_board_adc_channels'] > 0:
+        fields.append(('board_adc', '<u2', (header['num_board_adc_channels'], num_samples)))
+    if header['num_board_dig_in_channels'] > 0:
+        fields.append(('board_dig_in', '<u2', (num_samples,)))
+    if header['num_board_dig_out_channels'] > 0:
+        fields.append(('board_dig_out', '<u2', (num_samples,)))
+
+    dtype = np.dtype(fields)
+    if dtype.itemsize != get_bytes_per_data_block(header):
+        raise Exception('Data block dtype does not match the number of bytes per data block.')
+
+    return dtype
+
+
+def deinterleave_channels(blocks, field, num_channels, samples_per_block):
+    """Turns a (blocks, channels, samples) field into a (channels, blocks * samples) array."""
+
+    if num_channels == 0:
+        return np.zeros([0, len(blocks) * samples_per_block], dtype=np.uint16)
+    return blocks[field].transpose(1, 0, 2).reshape(num_channels, len(blocks) * samples_per_block)
+
+
+def blocks_to_data(header, blocks):
+    """Splits an array of structured data blocks into the raw data streams.
+
+    Returns a dictionary with the same keys and array shapes read_data fills in
+    with read_one_data_block, before any scaling is applied.
+    """
+
+    samples_per_block = header['num_samples_per_data_block']
+    num_samples = samples_per_block * len(blocks)
+
+    data = {}
+    data['t_amplifier'] = blocks['timestamps'].reshape(-1)
+    data['amplifier_data'] = deinterleave_channels(blocks, 'amplifier', header['num_amplifier_channels'], samples_per_block)
+    data['aux_input_data'] = deinterleave_channels(blocks, 'aux_input', header['num_aux_input_channels'], samples_per_block // 4)
+    data['supply_voltage_data'] = deinterleave_channels(blocks, 'supply_voltage', header['num_supply_voltage_channels'], 1)
+    data['temp_sensor_data'] = deinterleave_channels(blocks, 'temp_sensor', header['num_temp_sensor_channels'], 1)
+    data['board_adc_data'] = deinterleave_channels(blocks, 'board_adc', header['num_board_adc_channels'], samples_per_block)
+
+    if header['num_board_dig_in_channels'] > 0:
+        data['board_dig_in_raw'] = blocks['board_dig_in'].reshape(-1)
+    else:
+        data['board_dig_in_raw'] = np.zeros(num_samples, dtype=np.uint16)
+
+    if header['num_board_dig_out_channels'] > 0:
+        data['board_dig_out_raw'] = blocks['board_dig_out'].reshape(-1)
+    else:
+        data['board_dig_out_raw'] = np.zeros(num_samples, dtype=np.uint16)
+
+    return data
+
+
+def read_data_blocks(fid, header, num_data_blocks):
+    """Reads num_data_blocks 60 or 128 sample data blocks from fid with a single read."""
+
+    dtype = get_data_block_dtype(header)
+    blocks = np.fromfile(fid, dtype=dtype, count=num_data_blocks)
+    if len(blocks) != num_data_blocks:
+        raise Exception('Error: Unexpected end of file while reading data blocks.')
+
+    return blocks_to_data(header, blocks)
@@ -0,0 +1,255 @@
+#! /bin/env python
+#
+# Written for Jaeger Lab, 2020
+# Memory-mapped, lazy access to the data streams of an RHD2000 data file.
+# ------------------------------------------------------------------------------
+
+import sys
+import os
+import numpy as np
+
+from .read_header import read_header
+from .read_data_blocks import get_data_block_dtype
+from .scale_data import (AMPLIFIER_DATA_CONVERSION_FACTOR, scale_amplifier_data, scale_aux_input_data,
+                         scale_supply_voltage_data, scale_board_adc_data, scale_temp_sensor_data,
+                         scale_timestamps, extract_digital_channels, extract_digital_edges)
+
+
+class RHDStream:
+    """Lazy, sliceable view of one data stream of a memory-mapped RHD file.
+
+    Indexing follows the (channels, samples) layout of the arrays returned by
+    read_data. Only the data blocks touched by the requested samples are read
+    from disk and scaled.
+    """
+
+    def __init__(self, rhd, field, num_channels, samples_per_block, scale):
+        self.rhd = rhd
+        self.field = field
+        self.num_channels = num_channels
+        self.samples_per_block = samples_per_block
+        self.scale = scale
+
+    @property
+    def num_samples(self):
+        return self.rhd.num_data_blocks * self.samples_per_block
+
+    @property
+    def shape(self):
+        return (self.num_channels, self.num_samples)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        if len(key) > 2:
+            raise IndexError('Too many indices for RHD data stream.')
+        channel_key = key[0]
+        sample_key = key[1] if len(key) > 1 else slice(None)
+
+        channels = np.arange(self.num_channels)[channel_key]
+        squeeze = np.ndim(channels) == 0
+        channels = np.atleast_1d(channels)
+
+        first_block, last_block, local_key = self.blocks_range(sample_key)
+        out = self.read_blocks(first_block, last_block, channels)[:, local_key]
+        if squeeze:
+            out = out[0]
+        return out
+
+    def blocks_range(self, sample_key):
+        """Finds the data blocks spanned by sample_key and its index relative to the first block."""
+
+        samples = np.arange(self.num_samples)[sample_key]
+        if np.size(samples) == 0:
+            return 0, 0, slice(0, 0)
+        first_sample = int(np.min(samples))
+        last_sample = int(np.max(samples))
+        first_block = first_sample // self.samples_per_block
+        last_block = last_sample // self.samples_per_block + 1
+        offset = first_block * self.samples_per_block
+        if isinstance(sample_key, slice) and (sample_key.step is None or sample_key.step > 0):
+            step = sample_key.step or 1
+            local_key = slice(first_sample - offset, last_sample - offset + 1, step)
+        else:
+            local_key = samples - offset
+        return first_block, last_block, local_key
+
+    def read_blocks(self, first_block, last_block, channels):
+        """Reads and scales the selected channels from a range of data blocks."""
+
+        num_samples = (last_block - first_block) * self.samples_per_block
+        if self.num_channels == 0 or num_samples == 0:
+            return self.scale(np.zeros([len(channels), num_samples], dtype=np.uint16))
+        raw = self.rhd.blocks[first_block:last_block][self.field][:, channels, :]
+        return self.scale(raw.transpose(1, 0, 2).reshape(len(channels), num_samples))
+
+
+class RHDDigitalStream(RHDStream):
+    """Lazy view of board digital inputs or outputs, as boolean (channels, samples) arrays."""
+
+    def __init__(self, rhd, field, channels, samples_per_block):
+        super().__init__(rhd=rhd, field=field, num_channels=len(channels),
+                         samples_per_block=samples_per_block, scale=None)
+        self.channels = channels
+
+    def read_blocks(self, first_block, last_block, channels):
+        selected = [self.channels[ch] for ch in channels]
+        num_samples = (last_block - first_block) * self.samples_per_block
+        if self.num_channels == 0 or num_samples == 0:
+            return extract_digital_channels(np.zeros(num_samples, dtype=np.uint16), selected)
+        raw = self.rhd.blocks[first_block:last_block][self.field].reshape(num_samples)
+        return extract_digital_channels(raw, selected)
+
+    def edges(self, blocks_per_window=1000):
+        """Rising and falling edge sample indices of each channel, scanning the file in windows.
+
+        Returns one dictionary per channel, as extract_digital_edges.
+        """
+
+        rising = [[] for _ in self.channels]
+        falling = [[] for _ in self.channels]
+        previous = None
+        if self.num_channels > 0:
+            for first_block in range(0, self.rhd.num_data_blocks, blocks_per_window):
+                last_block = min(first_block + blocks_per_window, self.rhd.num_data_blocks)
+                raw = self.rhd.blocks[first_block:last_block][self.field].reshape(-1)
+                offset = first_block * self.samples_per_block
+                for ii, ch_edges in enumerate(extract_digital_edges(raw, self.channels, previous)):
+                    rising[ii].append(ch_edges['rising'] + offset)
+                    falling[ii].append(ch_edges['falling'] + offset)
+                previous = raw[-1]
+        return [{'rising': np.concatenate(r).astype(np.int64) if r else np.zeros(0, dtype=np.int64),
+                 'falling': np.concatenate(f).astype(np.int64) if f else np.zeros(0, dtype=np.int64)}
+                for r, f in zip(rising, falling)]
+
+
+class RHDWordStream(RHDStream):
+    """Lazy view of a one word per sample stream: amplifier timestamps or raw digital words."""
+
+    def __init__(self, rhd, field, samples_per_block, scale):
+        super().__init__(rhd=rhd, field=field, num_channels=1,
+                         samples_per_block=samples_per_block, scale=scale)
+
+    @property
+    def shape(self):
+        return (self.num_samples,)
+
+    def __getitem__(self, key):
+        return super().__getitem__((0, key))
+
+    def read_blocks(self, first_block, last_block, channels):
+        num_samples = (last_block - first_block) * self.samples_per_block
+        if self.field not in self.rhd.block_dtype.names:
+            return self.scale(np.zeros([1, num_samples], dtype=np.uint16))
+        raw = self.rhd.blocks[first_block:last_block][self.field].reshape(1, num_samples)
+        return self.scale(raw)
+
+
+class RHDFile:
+    """Intan Technologies RHD2000 data file, with its data section mapped with np.memmap.
+
+    The header is read on creation, data streams are exposed as lazy views that
+    decode only the data blocks a slice touches, e.g.:
+
+    rhd = RHDFile(filename)
+    window = rhd.amplifier_data[0:16, 20000:40000]   # int32, same as read_data
+
+    With native_dtypes=True, streams are scaled as by read_data(native_dtypes=True).
+    """
+
+    def __init__(self, filename, native_dtypes=False):
+        self.filename = filename
+        self.native_dtypes = native_dtypes
+        with open(filename, 'rb') as fid:
+            self.header = read_header(fid)
+            self.data_offset = fid.tell()
+        filesize = os.path.getsize(filename)
+
+        self.block_dtype = get_data_block_dtype(self.header)
+        bytes_remaining = filesize - self.data_offset
+        if bytes_remaining % self.block_dtype.itemsize != 0:
+            raise Exception('Something is wrong with file size : should have a whole number of data blocks')
+        self.num_data_blocks = bytes_remaining // self.block_dtype.itemsize
+
+        if self.num_data_blocks > 0:
+            self.blocks = np.memmap(filename, dtype=self.block_dtype, mode='r',
+                                    offset=self.data_offset, shape=(self.num_data_blocks,))
+        else:
+            self.blocks = np.zeros(0, dtype=self.block_dtype)
+
+        header = self.header
+        samples_per_block = header['num_samples_per_data_block']
+        self.amplifier_data = RHDStream(
+            rhd=self, field='amplifier', num_channels=header['num_amplifier_channels'],
+            samples_per_block=samples_per_block, scale=lambda raw: scale_amplifier_data(raw, native_dtypes)
+        )
+        self.aux_input_data = RHDStream(
+            rhd=self, field='aux_input', num_channels=header['num_aux_input_channels'],
+            samples_per_block=samples_per_block // 4, scale=lambda raw: scale_aux_input_data(raw, native_dtypes)
+        )
+        self.supply_voltage_data = RHDStream(
+            rhd=self, field='supply_voltage', num_channels=header['num_supply_voltage_channels'],
+            samples_per_block=1, scale=lambda raw: scale_supply_voltage_data(raw, native_dtypes)
+        )
+        self.temp_sensor_data = RHDStream(
+            rhd=self, field='temp_sensor', num_channels=header['num_temp_sensor_channels'],
+            samples_per_block=1, scale=lambda raw: scale_temp_sensor_data(raw, native_dtypes)
+        )
+        self.board_adc_data = RHDStream(
+            rhd=self, field='board_adc', num_channels=header['num_board_adc_channels'],
+            samples_per_block=samples_per_block, scale=lambda raw: scale_board_adc_data(header, raw, native_dtypes)
+        )
+        self.board_dig_in_data = RHDDigitalStream(
+            rhd=self, field='board_dig_in', channels=header['board_dig_in_channels'],
+            samples_per_block=samples_per_block
+        )
+        self.board_dig_out_data = RHDDigitalStream(
+            rhd=self, field='board_dig_out', channels=header['board_dig_out_channels'],
+            samples_per_block=samples_per_block
+        )
+        self.board_dig_in_raw = RHDWordStream(
+            rhd=self, field='board_dig_in', samples_per_block=samples_per_block, scale=lambda raw: raw
+        )
+        self.board_dig_out_raw = RHDWordStream(
+            rhd=self, field='board_dig_out', samples_per_block=samples_per_block, scale=lambda raw: raw
+        )
+        self.t_amplifier = RHDWordStream(
+            rhd=self, field='timestamps', samples_per_block=samples_per_block,
+            scale=lambda raw: scale_timestamps(header, raw)
+        )
+        self.t_amplifier_raw = RHDWordStream(
+            rhd=self, field='timestamps', samples_per_block=samples_per_block, scale=lambda raw: raw
+        )
+
+        self.amplifier_data_conversion_factor = AMPLIFIER_DATA_CONVERSION_FACTOR  # conversion factor to Volts
+
+    @property
+    def sample_rate(self):
+        return self.header['sample_rate']
+
+    @property
+    def num_samples(self):
+        return self.num_data_blocks * self.header['num_samples_per_data_block']
+
+    @property
+    def amplifier_channels(self):
+        return self.header['amplifier_channels']
+
+    def close(self):
+        """Releases the memory map of the data section."""
+        self.blocks = np.zeros(0, dtype=self.block_dtype)
+        self.num_data_blocks = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+if __name__ == '__main__':
+    rhd = RHDFile(sys.argv[1])
+    print(rhd.amplifier_data.shape)
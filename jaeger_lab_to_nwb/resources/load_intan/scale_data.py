@@ -0,0 +1,130 @@
+#! /bin/env python
+#
+# Written for Jaeger Lab, 2020
+# Scaling of raw RHD2000 data streams, shared by read_data and RHDFile.
+# ------------------------------------------------------------------------------
+
+import numpy as np
+
+# Conversion factor from amplifier_data (int32, offset removed) to Volts
+AMPLIFIER_DATA_CONVERSION_FACTOR = 0.195e-6
+
+
+def analog_dtype(native_dtypes=False):
+    """Floating point type of the scaled analog streams."""
+
+    return np.float32 if native_dtypes else np.float64
+
+
+def scale_amplifier_data(raw, native_dtypes=False):
+    """Removes the offset of raw amplifier samples, keeping them as integers.
+
+    With native_dtypes, samples keep their 16-bit width: flipping the most significant
+    bit of the uint16 words is the same as subtracting 32768, viewed as int16.
+    """
+
+    if native_dtypes:
+        return np.bitwise_xor(raw, np.uint16(0x8000)).view(np.int16)  # int16 dtype
+    # This line is the original (IntanTech provided) conversion to uVolts
+    # np.multiply(0.195, (raw.astype(np.int32) - 32768))      # units = microvolts
+    # Here we keep data in int32 and store the conversion scale to Volts separately
+    return raw.astype(np.int32) - 32768  # int32 dtype
+
+
+def scale_aux_input_data(raw, native_dtypes=False):
+    """Scales raw auxiliary input samples to Volts."""
+
+    return np.multiply(37.4e-6, raw, dtype=analog_dtype(native_dtypes))  # units = volts
+
+
+def scale_supply_voltage_data(raw, native_dtypes=False):
+    """Scales raw supply voltage samples to Volts."""
+
+    return np.multiply(74.8e-6, raw, dtype=analog_dtype(native_dtypes))  # units = volts
+
+
+def scale_board_adc_data(header, raw, native_dtypes=False):
+    """Scales raw board ADC samples to Volts, according to the evaluation board mode."""
+
+    dtype = analog_dtype(native_dtypes)
+    if header['eval_board_mode'] == 1:
+        return np.multiply(152.59e-6, (raw.astype(np.int32) - 32768), dtype=dtype)  # units = volts
+    elif header['eval_board_mode'] == 13:
+        return np.multiply(312.5e-6, (raw.astype(np.int32) - 32768), dtype=dtype)  # units = volts
+    else:
+        return np.multiply(50.354e-6, raw, dtype=dtype)  # units = volts
+
+
+def scale_temp_sensor_data(raw, native_dtypes=False):
+    """Scales raw temperature sensor samples to degrees Celsius."""
+
+    return np.multiply(0.01, raw, dtype=analog_dtype(native_dtypes))  # units = deg C
+
+
+def scale_timestamps(header, raw):
+    """Converts raw sample timestamps to seconds."""
+
+    return raw / header['sample_rate']
+
+
+def unpack_digital_words(raw):
+    """Unpacks all 16 bits of the raw digital words at once, as a (16, samples) boolean array.
+
+    Row i holds the channel with native_order i.
+    """
+
+    raw = np.ascontiguousarray(raw, dtype='<u2')
+    bits = np.unpackbits(raw.view(np.uint8).reshape(-1, 2), axis=1, bitorder='little')
+    return bits.T.view(np.bool_)
+
+
+def extract_digital_channels(raw, channels):
+    """Extracts each digital channel from the raw digital words as a boolean array."""
+
+    native_orders = np.array([channel['native_order'] for channel in channels], dtype=np.intp)
+    return unpack_digital_words(raw)[native_orders]
+
+
+def extract_digital_edges(raw, channels, previous=None):
+    """Finds the rising and falling edges of each digital channel in the raw digital words.
+
+    Only samples where the digital word changes are inspected, so the cost is set by
+    the number of transitions rather than by the number of channels.
+
+    Parameters
+    ----------
+    raw : array
+        Raw uint16 digital words.
+    channels : list
+        Digital channels, from the header (e.g. header['board_dig_in_channels']).
+    previous : int
+        Digital word preceding raw[0], e.g. the last word of the previous chunk. If
+        given, a transition at the first sample is also reported.
+
+    Returns
+    -------
+    list
+        One dictionary per channel, with the 'rising' and 'falling' sample indices
+        (relative to raw[0]) at which the channel turns on and off.
+    """
+
+    words = np.asarray(raw)
+    offset = 0
+    if previous is not None:
+        words = np.concatenate((np.array([previous], dtype=words.dtype), words))
+        offset = -1
+
+    changed = np.flatnonzero(words[1:] != words[:-1]) + 1
+    before = words[changed - 1]
+    after = words[changed]
+
+    edges = []
+    for channel in channels:
+        mask = 1 << channel['native_order']
+        was_on = np.not_equal(np.bitwise_and(before, mask), 0)
+        is_on = np.not_equal(np.bitwise_and(after, mask), 0)
+        edges.append({
+            'rising': changed[is_on & ~was_on] + offset,
+            'falling': changed[was_on & ~is_on] + offset
+        })
+    return edges
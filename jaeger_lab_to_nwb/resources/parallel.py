@@ -0,0 +1,119 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from collections import deque
+
+
+def prefetch_map(func, items, n_workers, max_prefetch=None, **kwargs):
+    """
+    Maps func over items in a process pool, yielding results in the order of items.
+
+    At most max_prefetch items are submitted ahead of the one being consumed, which
+    caps how many decoded results are held in memory at any time.
+
+    Parameters
+    ----------
+    func : callable
+        Module-level function, called as func(item, **kwargs) in a worker process.
+    items : iterable
+        Items to be processed, in output order.
+    n_workers : int
+        Number of worker processes.
+    max_prefetch : int
+        Maximum number of items submitted and not yet consumed. Defaults to n_workers.
+    """
+    if max_prefetch is None:
+        max_prefetch = n_workers
+    max_prefetch = max(1, max_prefetch)
+
+    items = iter(items)
+    executor = ProcessPoolExecutor(max_workers=n_workers)
+    try:
+        pending = deque()
+        for item in items:
+            pending.append(executor.submit(func, item, **kwargs))
+            if len(pending) >= max_prefetch:
+                break
+        while pending:
+            result = pending.popleft().result()
+            # Keeps the pool busy while the current result is consumed
+            for item in items:
+                pending.append(executor.submit(func, item, **kwargs))
+                break
+            yield result
+    finally:
+        # Also when the consumer stops early (generator closed): prefetched items
+        # not yet started are cancelled, and the worker processes are shut down
+        executor.shutdown(cancel_futures=True)
+
+
+class PrefetchHub:
+    """
+    Shared access to the ordered results of prefetch_map, for several consumers.
+
+    Results are computed in the order of items, in a process pool, and kept until
+    each of their n_consumers has released them. This lets e.g. the donor and
+    acceptor iterators of a trial share one decoding task.
+
+    Parameters
+    ----------
+    func : callable
+        Module-level function, called as func(item, **kwargs) in a worker process.
+    items : list
+        Items to be processed, in the order they are expected to be consumed.
+    n_consumers : int
+        Number of release calls after which a result is dropped.
+    n_workers : int
+        Number of worker processes.
+    max_prefetch : int
+        Maximum number of items submitted and not yet consumed. Defaults to n_workers.
+    """
+
+    def __init__(self, func, items, n_consumers, n_workers, max_prefetch=None, **kwargs):
+        self._results = prefetch_map(func=func, items=items, n_workers=n_workers,
+                                     max_prefetch=max_prefetch, **kwargs)
+        self.n_items = len(items)
+        self.n_consumers = n_consumers
+        self._next_index = 0
+        self._cache = dict()
+        self._remaining = dict()
+
+    def get(self, index):
+        """Result of items[index], waiting for it and for the results before it."""
+        while index not in self._cache:
+            if index < self._next_index:
+                raise Exception('Result ' + str(index) + ' was already released.')
+            self._cache[self._next_index] = next(self._results)
+            self._remaining[self._next_index] = self.n_consumers
+            self._next_index += 1
+            if self._next_index == self.n_items:
+                # Runs prefetch_map to its end, which shuts down the process pool
+                for _ in self._results:
+                    pass
+        return self._cache[index]
+
+    def release(self, index):
+        """Marks the result of items[index] as consumed by one of its consumers."""
+        self._remaining[index] -= 1
+        if self._remaining[index] == 0:
+            del self._cache[index]
+            del self._remaining[index]
+
+
+def parse_concurrently(parsers):
+    """
+    Runs independent parse functions concurrently, one thread each.
+
+    Parameters
+    ----------
+    parsers : dict
+        name -> (func, kwargs), each called as func(**kwargs).
+
+    Returns
+    -------
+    dict
+        name -> result of its parse function. Exceptions are raised in the caller.
+    """
+    if len(parsers) == 0:
+        return dict()
+    with ThreadPoolExecutor(max_workers=len(parsers)) as executor:
+        futures = {name: executor.submit(func, **kwargs) for name, (func, kwargs) in parsers.items()}
+        return {name: future.result() for name, future in futures.items()}
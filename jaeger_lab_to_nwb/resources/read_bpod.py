@@ -0,0 +1,146 @@
+import numpy as np
+import h5py
+
+# Trials summary fields of SessionData, with their key in the loaded session
+BPOD_TRIALS_FIELDS = {
+    'TrialStartTimestamp': 'trial_start_timestamps',
+    'TrialEndTimestamp': 'trial_end_timestamps',
+    'TrialTypes': 'trial_types',
+    'LEDTypes': 'led_types',
+    'Reaching': 'reaching',
+    'Outcome': 'outcome',
+}
+
+
+def read_bpod_session(fpath):
+    """
+    Reads the SessionData fields used in conversion from a Bpod .mat file, as flat arrays.
+
+    MATLAB v7.3 files are HDF5 files and are read lazily with h5py, other versions are
+    read with scipy.io.loadmat, restricted to the SessionData variable.
+
+    Returns
+    -------
+    dict
+        {'session_date': str, 'session_start_time': str (UTC), 'n_trials': int,
+         'trial_start_timestamps', 'trial_end_timestamps', 'trial_types', 'led_types',
+         'reaching', 'outcome': arrays with one value per trial,
+         'all_states_names': sorted names of all states of the session,
+         'states_names': names of the states visited, flattened over trials,
+         'states_durations': duration of each visited state,
+         'states_offsets': end offset of each trial's states in the flat arrays,
+         'events': {event name: (timestamps relative to trial start, end offset of each trial)}}
+    """
+    if h5py.is_hdf5(fpath):
+        with h5py.File(fpath, 'r') as f:
+            session = read_session_h5(f)
+    else:
+        session = read_session_mat(fpath)
+    return flatten_session(session)
+
+
+def read_session_mat(fpath):
+    """Reads SessionData fields from a MATLAB v5 .mat file, as lists with one entry per trial."""
+    from scipy.io import loadmat
+
+    fdata = loadmat(fpath, variable_names=['SessionData'], struct_as_record=False, squeeze_me=True)
+    session_data = fdata['SessionData']
+    n_trials = int(session_data.nTrials)
+
+    # Squeezed cells of a single trial are not wrapped in an array
+    def trial_cells(cells):
+        return [cells] if n_trials == 1 else list(cells)
+
+    session = {
+        'session_date': session_data.Info.SessionDate,
+        'session_start_time': session_data.Info.SessionStartTime_UTC,
+        'n_trials': n_trials,
+        'states_names_by_number': [list(np.atleast_1d(names)) for names in
+                                   trial_cells(session_data.RawData.OriginalStateNamesByNumber)],
+        'states_numbers': trial_cells(session_data.RawData.OriginalStateData),
+        'states_timestamps': trial_cells(session_data.RawData.OriginalStateTimestamps),
+        'events': [{event: getattr(trial.Events, event) for event in trial.Events._fieldnames}
+                   for trial in trial_cells(session_data.RawEvents.Trial)],
+    }
+    for field, key in BPOD_TRIALS_FIELDS.items():
+        session[key] = getattr(session_data, field)
+    return session
+
+
+def read_session_h5(f):
+    """Reads SessionData fields from an open MATLAB v7.3 (HDF5) file, as lists with one entry per trial."""
+    session_data = f['SessionData']
+    raw_data = session_data['RawData']
+
+    # Trials of RawEvents are a cell array of structs, or a struct array
+    trials = session_data['RawEvents']['Trial']
+    if isinstance(trials, h5py.Group):
+        events_groups = [f[ref] for ref in trials['Events'][()].ravel()]
+    else:
+        events_groups = [f[ref]['Events'] for ref in trials[()].ravel()]
+
+    session = {
+        'session_date': read_h5_value(f, session_data['Info']['SessionDate']),
+        'session_start_time': read_h5_value(f, session_data['Info']['SessionStartTime_UTC']),
+        'n_trials': int(read_h5_value(f, session_data['nTrials'])[0]),
+        'states_names_by_number': read_h5_value(f, raw_data['OriginalStateNamesByNumber']),
+        'states_numbers': read_h5_value(f, raw_data['OriginalStateData']),
+        'states_timestamps': read_h5_value(f, raw_data['OriginalStateTimestamps']),
+        'events': [{event: read_h5_value(f, group[event]) for event in group} for group in events_groups],
+    }
+    for field, key in BPOD_TRIALS_FIELDS.items():
+        session[key] = read_h5_value(f, session_data[field])
+    return session
+
+
+def read_h5_value(f, dataset):
+    """
+    Reads a MATLAB v7.3 dataset: char arrays as str, cell arrays as lists (elements
+    in MATLAB linear order) and numeric arrays as flat NumPy arrays.
+    """
+    matlab_class = dataset.attrs.get('MATLAB_class', b'')
+    if isinstance(matlab_class, bytes):
+        matlab_class = matlab_class.decode()
+    if dataset.attrs.get('MATLAB_empty', 0):
+        return '' if matlab_class == 'char' else np.zeros(0)
+    # HDF5 dimensions are reversed from MATLAB, so C order is MATLAB linear order
+    values = dataset[()].ravel()
+    if matlab_class == 'char':
+        return ''.join(chr(c) for c in values)
+    if matlab_class == 'cell':
+        return [read_h5_value(f, f[ref]) for ref in values]
+    return values
+
+
+def flatten_session(session):
+    """Flattens the per-trial lists of read_session_mat / read_session_h5, see read_bpod_session."""
+    n_trials = session['n_trials']
+    flat = {
+        'session_date': session['session_date'],
+        'session_start_time': session['session_start_time'],
+        'n_trials': n_trials,
+    }
+    for key in BPOD_TRIALS_FIELDS.values():
+        flat[key] = np.atleast_1d(session[key])
+
+    # States visited in each trial, named after OriginalStateNamesByNumber
+    names_by_number = [np.asarray(names, dtype=object) for names in session['states_names_by_number']]
+    trials_states_names = [
+        names_by_number[tr][np.atleast_1d(session['states_numbers'][tr]).astype(int) - 1]
+        for tr in range(n_trials)
+    ]
+    flat['all_states_names'] = np.unique(np.concatenate(names_by_number + [np.zeros(0, dtype=object)]))
+    flat['states_names'] = np.concatenate(trials_states_names + [np.zeros(0, dtype=object)])
+    flat['states_durations'] = np.concatenate(
+        [np.diff(np.atleast_1d(ts)) for ts in session['states_timestamps'][:n_trials]] + [np.zeros(0)])
+    flat['states_offsets'] = np.cumsum([len(names) for names in trials_states_names], dtype=np.int64)
+
+    # Events timestamps, relative to trial start
+    events = {}
+    for event in sorted({event for trial_events in session['events'] for event in trial_events}):
+        timestamps = [np.atleast_1d(trial_events.get(event, np.zeros(0))).astype(np.float64)
+                      for trial_events in session['events'][:n_trials]]
+        events[event] = (np.concatenate(timestamps + [np.zeros(0)]),
+                         np.cumsum([len(ts) for ts in timestamps], dtype=np.int64))
+    flat['events'] = events
+    return flat
@@ -0,0 +1,110 @@
+import numpy as np
+import os
+
+# Each .rsd raw frame is a 128 x 100 array of int16 words, stored in Fortran order.
+# Rows 20:120 hold the 100 x 100 image, rows 0:20 hold the excess (analog) data.
+RSD_FRAME_SHAPE = (128, 100)
+RSD_IMAGE_ROWS = slice(20, 120)
+RSD_IMAGE_SHAPE = (100, 100)
+RSD_EXCESS_ROWS = slice(0, 20)
+
+# Analog channels in the excess rows, each sampled 20 times per frame at columns 0:80:4
+RSD_ANALOG_ROWS = {'analog_1': 12, 'analog_2': 14, 'stim_trigger': 8}
+RSD_ANALOG_COLUMNS = slice(0, 80, 4)
+RSD_ANALOG_SAMPLES_PER_FRAME = 20
+
+
+def read_rsd_file(fpath):
+    """
+    Maps a .rsd raw data file as a (n_frames, 128, 100) int16 array, without copying.
+
+    The file is memory-mapped and reshaped once in Fortran order, so frames are
+    views into the file. A trailing incomplete frame, if any, is ignored.
+    """
+    n_frames = rsd_file_n_frames(fpath)
+    if n_frames == 0:
+        return np.zeros((0,) + RSD_FRAME_SHAPE, dtype='<i2')
+    words = np.memmap(fpath, dtype='<i2', mode='r', shape=(n_frames * RSD_FRAME_SHAPE[0] * RSD_FRAME_SHAPE[1],))
+    return words.reshape(RSD_FRAME_SHAPE + (n_frames,), order='F').transpose(2, 0, 1)
+
+
+def decode_rsd_frames(raw):
+    """Image frames (n_frames, 100, 100) of raw .rsd data, with the sign of camera data inverted."""
+    return np.negative(raw[:, RSD_IMAGE_ROWS, :])
+
+
+def decode_rsd_analog(raw):
+    """
+    Analog channels of the excess rows of raw .rsd data, as a (n_frames * 20, 3) int16
+    array, with columns in the order of RSD_ANALOG_ROWS and the same sign as the frames.
+    """
+    rows = list(RSD_ANALOG_ROWS.values())
+    excess = np.negative(raw[:, rows, RSD_ANALOG_COLUMNS])
+    return excess.transpose(0, 2, 1).reshape(-1, len(rows))
+
+
+def rsd_file_n_frames(fpath):
+    """Number of complete frames in a .rsd raw data file, from its size."""
+    return os.path.getsize(fpath) // (2 * RSD_FRAME_SHAPE[0] * RSD_FRAME_SHAPE[1])
+
+
+def read_rsd_channels(channels_files):
+    """Decodes the image frames and analog channels of several channels, e.g. donor and acceptor of a trial.
+
+    channels_files is a list with the .rsd file paths of each channel. Returns one
+    (frames, analog) pair per channel: a (n_frames, 100, 100) int16 array and the
+    (n_frames * 20, 3) int16 array of decode_rsd_analog. Used in worker processes.
+    """
+    decoded = []
+    for files in channels_files:
+        raws = [read_rsd_file(fpath) for fpath in files]
+        frames = np.concatenate([decode_rsd_frames(raw) for raw in raws] +
+                                [np.zeros((0,) + RSD_IMAGE_SHAPE, dtype='<i2')], axis=0)
+        analog = np.concatenate([decode_rsd_analog(raw) for raw in raws] +
+                                [np.zeros((0, len(RSD_ANALOG_ROWS)), dtype='<i2')], axis=0)
+        decoded.append((frames, analog))
+    return decoded
+
+
+def trigger_onsets(trigger):
+    """
+    Sample indices at which a trigger signal crosses, upwards, the midpoint between its
+    minimum and maximum. A flat signal has no onsets.
+    """
+    trigger = np.asarray(trigger)
+    if trigger.size == 0 or trigger.min() == trigger.max():
+        return np.zeros(0, dtype=np.int64)
+    threshold = (float(trigger.min()) + float(trigger.max())) / 2
+    above = trigger > threshold
+    return np.flatnonzero(above[1:] & ~above[:-1]) + 1
+
+
+def read_rsh(fpath):
+    """
+    Parses a .rsh header file in one pass, into a compact, JSON serializable record.
+
+    Returns
+    -------
+    dict
+        {'acquisition_date': str, 'sample_rate': float (Hz), 'n_frames': int,
+         'file_rsm': bitmap of monitor file, 'files_raw': list of .rsd file names}
+    """
+    record = {'acquisition_date': None, 'sample_rate': None, 'n_frames': None, 'file_rsm': None, 'files_raw': []}
+    with open(fpath, 'r') as f:
+        lines = f.read().splitlines()
+    for ii, line in enumerate(lines):
+        key, _, value = line.partition('=')
+        key = key.strip()
+        if key == 'acquisition_date':
+            record['acquisition_date'] = value.strip()
+        elif key == 'sample_time':
+            record['sample_rate'] = 1 / (float(value.replace('msec', '').strip()) / 1000.)
+        elif key == 'page_frames':
+            record['n_frames'] = int(value.strip())
+        elif 'Data-File-List' in line:
+            # Next lines are file names: the .rsm file (bitmap of monitor), then .rsd files (raw data)
+            files = [fname.strip() for fname in lines[ii + 1:] if fname.strip() != '']
+            record['file_rsm'] = files[0]
+            record['files_raw'] = files[1:]
+            break
+    return record
@@ -0,0 +1,146 @@
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+import numpy as np
+import hashlib
+import json
+import os
+
+# Number of rows read ahead to find the columns of a table, and which of them are floats
+SNIFF_ROWS = 100
+
+
+def has_pyarrow():
+    """Whether pyarrow is installed, for the pyarrow CSV engine and Feather caches."""
+    try:
+        import pyarrow  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def table_cache_path(fpath, options):
+    """
+    Feather cache file of a parsed table, next to the source file. The cache name
+    depends on the reading options, so that tables read with different dtypes or
+    column names do not share a cache.
+    """
+    key = hashlib.md5(json.dumps(options, sort_keys=True, default=str).encode()).hexdigest()[:8]
+    head, tail = os.path.split(fpath)
+    return os.path.join(head, '.' + tail + '.' + key + '.feather')
+
+
+def read_table(fpath, sep=',', names=None, dtype=None, float_dtype=None, cache=False):
+    """
+    Reads a csv/tsv table with compact, explicit dtypes.
+
+    Parameters
+    ----------
+    fpath : str
+        Path to the csv/tsv file.
+    sep : str
+        Column separator.
+    names : list
+        Column names, for files without a header line. If None, the first line is the header.
+    dtype : dict
+        Column name -> dtype, e.g. {'Lick 1': 'int8'}, parsed directly to these dtypes.
+        Integer flags written as floats ('1.0') are read as well.
+    float_dtype : str
+        dtype of the remaining float64 columns, e.g. 'float32'. If None, they are kept as float64.
+        Float columns are found from the first SNIFF_ROWS rows and parsed directly to
+        float_dtype. Columns found to be floats further down are cast after parsing.
+    cache : bool
+        Caches the parsed table as a Feather file next to the source, used while it
+        is newer than the source. Requires pyarrow.
+
+    Returns
+    -------
+    DataFrame
+    """
+    dtype = dtype or {}
+    use_pyarrow = has_pyarrow()
+
+    # Parsed table from cache, if up to date
+    cache_file = None
+    if cache and use_pyarrow:
+        cache_file = table_cache_path(fpath, {'sep': sep, 'names': names, 'dtype': dtype, 'float_dtype': float_dtype})
+        if os.path.isfile(cache_file) and os.path.getmtime(cache_file) >= os.path.getmtime(fpath):
+            return pd.read_feather(cache_file)
+
+    read_kwargs = {'sep': sep, 'index_col': False}
+    if names is not None:
+        read_kwargs.update({'header': None, 'names': names})
+
+    # Dtypes passed to the parser, for the columns of the file, so that full width
+    # columns are not built and then copied
+    sniff = pd.read_csv(fpath, nrows=SNIFF_ROWS, **read_kwargs)
+    parse_dtype = {col: dt for col, dt in dtype.items() if col in sniff.columns}
+    if float_dtype is not None:
+        parse_dtype.update({col: float_dtype for col in sniff.columns
+                            if col not in dtype and sniff[col].dtype == np.float64})
+
+    try:
+        df = parse_table(fpath, sep, names, parse_dtype, use_pyarrow)
+    except (ValueError, TypeError):
+        # Columns the parser cannot type (e.g. missing values in integer columns) are cast below
+        df = parse_table(fpath, sep, names, {}, use_pyarrow)
+
+    # Fallback for columns not parsed to their dtypes, e.g. floats past the first rows
+    df = df.astype({col: dt for col, dt in dtype.items() if col in df.columns and df[col].dtype != dt})
+    if float_dtype is not None:
+        df = df.astype({col: float_dtype for col in df.columns
+                        if col not in dtype and df[col].dtype == np.float64})
+
+    if cache_file is not None:
+        try:
+            df.to_feather(cache_file)
+        except OSError:
+            print('Could not write table cache to: ', cache_file)
+    return df
+
+
+def parse_table(fpath, sep, names, dtype, use_pyarrow):
+    """
+    Parses a csv/tsv table to the given dtypes. Files with a header line are parsed by
+    pyarrow if use_pyarrow, with the dtypes as column types, so that full width columns
+    are not built. Other files, and files pyarrow cannot parse to these dtypes, are read
+    by the pandas C engine, whose index_col=False drops the empty column of trailing
+    delimiters before the column names are applied.
+    """
+    if use_pyarrow and names is None:
+        import pyarrow
+        from pyarrow import csv as pa_csv
+        column_types = {col: pyarrow.from_numpy_dtype(np.dtype(dt)) for col, dt in dtype.items()}
+        try:
+            table = pa_csv.read_csv(
+                fpath,
+                parse_options=pa_csv.ParseOptions(delimiter=sep),
+                convert_options=pa_csv.ConvertOptions(column_types=column_types),
+            )
+        except pyarrow.ArrowInvalid:
+            # e.g. trailing delimiters in data lines only, or integer flags written
+            # as floats ('1.0'), handled by the C engine
+            pass
+        else:
+            null_columns = [ii for ii, field in enumerate(table.schema) if pyarrow.types.is_null(field.type)]
+            df = table.to_pandas(split_blocks=True, self_destruct=True)
+            del table
+            # Empty columns of trailing delimiters, as NaN and named as by the C engine
+            for ii in null_columns:
+                df.isetitem(ii, np.full(len(df), np.nan))
+            df.columns = [col if col != '' else 'Unnamed: ' + str(ii) for ii, col in enumerate(df.columns)]
+            return df
+    read_kwargs = {'sep': sep, 'index_col': False, 'dtype': dtype or None}
+    if names is not None:
+        read_kwargs.update({'header': None, 'names': names})
+    return pd.read_csv(fpath, **read_kwargs)
+
+
+def read_tables(fpaths, n_workers=0, **kwargs):
+    """
+    Reads several csv/tsv tables with read_table, in a thread pool if n_workers > 0.
+    Tables are returned in the order of fpaths.
+    """
+    if n_workers > 0:
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            return list(executor.map(lambda fpath: read_table(fpath, **kwargs), fpaths))
+    return [read_table(fpath, **kwargs) for fpath in fpaths]
@@ -0,0 +1,310 @@
+from jaeger_lab_to_nwb.resources.load_intan.read_header import read_header
+from jaeger_lab_to_nwb.resources.load_intan.read_data_blocks import get_data_block_dtype
+from jaeger_lab_to_nwb.resources.load_intan.rhd_file import RHDFile
+from jaeger_lab_to_nwb.resources.read_rsd import read_rsh
+
+from pathlib import Path
+import numpy as np
+import json
+import re
+import os
+
+RHD_INDEX_FILE = '.rhd_index.json'
+RSH_INDEX_FILE = '.rsh_index.json'
+
+# Cortical imaging headers: <prefix><trial>.rsh, <prefix><trial>_A.rsh (donor), <prefix><trial>_B.rsh (acceptor)
+RSH_NAME_PATTERN = re.compile(r'^(?P<prefix>.+-)(?P<trial>[^-]+?)(?:_(?P<channel>[AB]))?\.rsh$')
+
+
+def read_index_cache(cache_file):
+    """Reads a cached session index, returns None if it does not exist or is unreadable."""
+    try:
+        with open(cache_file, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_index_cache(cache_file, index):
+    """Writes a session index next to the source files, if the directory is writable."""
+    try:
+        with open(cache_file, 'w') as f:
+            json.dump(index, f)
+    except OSError:
+        print('Could not write session index cache to: ', cache_file)
+
+
+def file_signature(fpath):
+    """Size and modification time of a file, used to validate cached index records."""
+    stat = os.stat(fpath)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime}
+
+
+def read_rhd_record(fpath):
+    """Reads the header of a .rhd file and returns a compact, JSON serializable record."""
+    with open(fpath, 'rb') as fid:
+        header = read_header(fid)
+        data_offset = fid.tell()
+        signature = file_signature(fpath)
+
+        # Number of samples from file size
+        block_dtype = get_data_block_dtype(header)
+        bytes_remaining = signature['size'] - data_offset
+        if bytes_remaining % block_dtype.itemsize != 0:
+            raise Exception('Something is wrong with file size : should have a whole number of data blocks. '
+                            'File: ' + str(fpath))
+        n_blocks = bytes_remaining // block_dtype.itemsize
+
+        # First and last timestamps, from the first and last data blocks
+        first_timestamp, last_timestamp = None, None
+        if n_blocks > 0:
+            timestamps_dtype = block_dtype['timestamps']
+            first_block_ts = np.frombuffer(fid.read(timestamps_dtype.itemsize), dtype=timestamps_dtype.base)
+            fid.seek(data_offset + (n_blocks - 1) * block_dtype.itemsize)
+            last_block_ts = np.frombuffer(fid.read(timestamps_dtype.itemsize), dtype=timestamps_dtype.base)
+            first_timestamp = int(first_block_ts[0])
+            last_timestamp = int(last_block_ts[-1])
+
+    record = {
+        'name': Path(fpath).name,
+        'data_offset': data_offset,
+        'sample_rate': header['sample_rate'],
+        'num_samples_per_data_block': header['num_samples_per_data_block'],
+        'n_samples': n_blocks * header['num_samples_per_data_block'],
+        'first_timestamp': first_timestamp,
+        'last_timestamp': last_timestamp,
+        'amplifier_channels': [ch['native_channel_name'] for ch in header['amplifier_channels']],
+        'board_dig_in_channels': [ch['native_channel_name'] for ch in header['board_dig_in_channels']],
+    }
+    record.update(signature)
+    return record, header
+
+
+def index_rhd_session(source_dir, cache=True):
+    """
+    Indexes all .rhd files of a session directory, reading only their headers.
+
+    Each file gets a record with its sample rate, number of samples (from file size),
+    first and last raw timestamps and channel names. The header of the first file is
+    kept in full. If cache is True, the index is stored in a sidecar file in source_dir
+    and records of files with unchanged size and modification time are reused.
+
+    Returns
+    -------
+    dict
+        {'header_file': name of first file, 'header': its header,
+         'files': list of records sorted by file name}
+    """
+    cache_file = Path(source_dir) / RHD_INDEX_FILE
+    cached = read_index_cache(cache_file) if cache else None
+    cached_records = dict()
+    if cached is not None:
+        cached_records = {rec['name']: rec for rec in cached['files']}
+
+    all_files = sorted([f for f in os.listdir(source_dir) if f.endswith(".rhd")])
+    if len(all_files) == 0:
+        raise Exception('No .rhd files found in: ' + str(source_dir))
+
+    records = []
+    headers = dict()
+    for fname in all_files:
+        fpath = Path(source_dir) / fname
+        rec = cached_records.get(fname)
+        if rec is None or file_signature(fpath) != {'size': rec['size'], 'mtime': rec['mtime']}:
+            rec, headers[fname] = read_rhd_record(fpath)
+        records.append(rec)
+    updated = cached is None or len(headers) > 0 or set(cached_records) != set(all_files)
+
+    # Full header of the first file
+    if all_files[0] in headers:
+        header = headers[all_files[0]]
+    elif cached is not None and cached.get('header_file') == all_files[0]:
+        header = cached['header']
+    else:
+        with open(Path(source_dir) / all_files[0], 'rb') as fid:
+            header = read_header(fid)
+        updated = True
+
+    # All files in a session should share acquisition parameters
+    for rec in records[1:]:
+        if rec['sample_rate'] != records[0]['sample_rate'] or \
+                rec['amplifier_channels'] != records[0]['amplifier_channels']:
+            raise Exception('Sample rate or amplifier channels of ' + rec['name'] +
+                            ' do not match those of ' + records[0]['name'])
+
+    index = {'header_file': all_files[0], 'header': header, 'files': records}
+    if cache and updated:
+        write_index_cache(cache_file, index)
+    return index
+
+
+def find_valid_segments(valid, timestamps):
+    """
+    Run-length encodes valid samples into segments of contiguous timestamps.
+
+    A segment is split wherever the valid flag changes or consecutive timestamps
+    do not increase by exactly one sample.
+
+    Returns
+    -------
+    list
+        [start, stop, first_timestamp] of each valid segment, stop exclusive.
+    """
+    valid = np.asarray(valid, dtype=bool)
+    if len(valid) == 0:
+        return []
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    breaks = np.flatnonzero((valid[1:] != valid[:-1]) | (np.diff(timestamps) != 1)) + 1
+    bounds = np.concatenate(([0], breaks, [len(valid)]))
+    is_valid = valid[bounds[:-1]]
+    starts = bounds[:-1][is_valid]
+    stops = bounds[1:][is_valid]
+    return [[int(start), int(stop), int(timestamps[start])] for start, stop in zip(starts, stops)]
+
+
+def continues(segment, start, first_timestamp):
+    """Whether a segment starting at sample start, with first_timestamp, continues segment."""
+    seg_start, seg_stop, seg_first_timestamp = segment
+    return seg_stop == start and seg_first_timestamp + (seg_stop - seg_start) == first_timestamp
+
+
+def rhd_file_valid_segments(fpath, blocks_per_window=1000):
+    """Finds the valid segments of a .rhd file, reading its digital inputs and timestamps in windows."""
+    segments = []
+    with RHDFile(fpath) as rhd:
+        samples_per_window = rhd.header['num_samples_per_data_block'] * blocks_per_window
+        for start in range(0, rhd.num_samples, samples_per_window):
+            stop = min(start + samples_per_window, rhd.num_samples)
+            window_segments = find_valid_segments(
+                valid=rhd.board_dig_in_data[0, start:stop],
+                timestamps=rhd.t_amplifier_raw[start:stop]
+            )
+            for seg_start, seg_stop, first_timestamp in window_segments:
+                if segments and continues(segments[-1], seg_start + start, first_timestamp):
+                    segments[-1][1] = seg_stop + start
+                else:
+                    segments.append([seg_start + start, seg_stop + start, first_timestamp])
+    return segments
+
+
+def rhd_valid_segments(source_dir, index, cache=True):
+    """
+    Returns the valid segments of each indexed .rhd file.
+
+    Segments are computed only for records that do not have them yet, and stored in
+    the index (and its cache), so that each file is scanned at most once.
+
+    Returns
+    -------
+    list
+        For each file, a list of [start, stop, first_timestamp] segments.
+    """
+    updated = False
+    for rec in index['files']:
+        if rec.get('valid_segments') is None:
+            rec['valid_segments'] = rhd_file_valid_segments(Path(source_dir) / rec['name'])
+            updated = True
+    if cache and updated:
+        write_index_cache(Path(source_dir) / RHD_INDEX_FILE, index)
+    return [rec['valid_segments'] for rec in index['files']]
+
+
+def join_file_segments(index, file_segments):
+    """
+    Joins valid segments of consecutive files, where samples and timestamps continue
+    from the end of one file into the start of the next one.
+
+    Returns
+    -------
+    list
+        One dictionary per session segment, with its 'first_timestamp', 'n_samples'
+        and 'pieces': a list of (file_index, start, stop) sample ranges.
+    """
+    joined = []
+    last_file_segment = None
+    for ii, (rec, segments) in enumerate(zip(index['files'], file_segments)):
+        for start, stop, first_timestamp in segments:
+            if last_file_segment is not None and start == 0 and \
+                    continues(last_file_segment, index['files'][ii - 1]['n_samples'], first_timestamp):
+                joined[-1]['pieces'].append((ii, start, stop))
+                joined[-1]['n_samples'] += stop - start
+            else:
+                joined.append({
+                    'first_timestamp': first_timestamp,
+                    'n_samples': stop - start,
+                    'pieces': [(ii, start, stop)]
+                })
+            last_file_segment = None
+        # Only a segment reaching the end of a file may continue into the next one
+        last_file_segment = None
+        if len(segments) > 0 and segments[-1][1] == rec['n_samples']:
+            last_file_segment = segments[-1]
+    return joined
+
+
+def drop_short_segments(segments, min_samples):
+    """
+    Session segments of join_file_segments with at least min_samples samples. Short
+    segments are dropped rather than merged across the gaps between them, as the
+    samples of a gap are invalid or missing.
+    """
+    return [segment for segment in segments if segment['n_samples'] >= min_samples]
+
+
+def index_rsh_session(source_dir, cache=True):
+    """
+    Indexes all .rsh headers of a cortical imaging directory, parsing each of them once.
+
+    Headers are grouped by trial, with the file name prefix (e.g. 'VSFP_01A0801-') and
+    trial numbers discovered from file names. If cache is True, parsed records are
+    stored in a sidecar file in source_dir and reused while the size and modification
+    time of their header file are unchanged.
+
+    Returns
+    -------
+    dict
+        {'prefix': file name prefix,
+         'trials': list sorted by trial, of {'trial': trial number, 'header': record,
+                   'A': donor record, 'B': acceptor record}}
+        Records are those of read_rsd.read_rsh, plus the header file 'name'.
+    """
+    cache_file = Path(source_dir) / RSH_INDEX_FILE
+    cached = read_index_cache(cache_file) if cache else None
+    cached_records = dict()
+    if cached is not None:
+        cached_records = {rec['name']: rec for rec in cached['files']}
+
+    all_files = sorted([f for f in os.listdir(source_dir) if RSH_NAME_PATTERN.match(f)])
+    if len(all_files) == 0:
+        raise Exception('No .rsh files found in: ' + str(source_dir))
+
+    records = []
+    updated = cached is None or set(cached_records) != set(all_files)
+    for fname in all_files:
+        fpath = Path(source_dir) / fname
+        rec = cached_records.get(fname)
+        if rec is None or file_signature(fpath) != {'size': rec['size'], 'mtime': rec['mtime']}:
+            rec = read_rsh(fpath)
+            rec['name'] = fname
+            rec.update(file_signature(fpath))
+            updated = True
+        records.append(rec)
+    if cache and updated:
+        write_index_cache(cache_file, {'files': records})
+
+    # Groups headers by prefix and trial
+    trials = dict()
+    for rec in records:
+        match = RSH_NAME_PATTERN.match(rec['name'])
+        key = (match.group('prefix'), match.group('trial'))
+        trial = trials.setdefault(key, {'trial': match.group('trial')})
+        trial[match.group('channel') or 'header'] = rec
+
+    prefixes = sorted(set([key[0] for key in trials]))
+    if len(prefixes) > 1:
+        raise Exception('More than one .rsh file name prefix found in ' + str(source_dir) + ': ' + str(prefixes))
+    for key, trial in trials.items():
+        if not all([k in trial for k in ['header', 'A', 'B']]):
+            raise Exception('Missing header, donor (_A) or acceptor (_B) .rsh file for trial ' + ''.join(key))
+
+    return {'prefix': prefixes[0], 'trials': [trials[key] for key in sorted(trials)]}
@@ -0,0 +1,51 @@
+import numpy as np
+
+
+def uniform_rate(timestamps, tolerance=1e-3):
+    """
+    Detects uniformly sampled timestamps.
+
+    Parameters
+    ----------
+    timestamps : array
+        Timestamps in seconds.
+    tolerance : float
+        Maximum deviation of any timestamp from its uniform reconstruction, as a
+        fraction of the sampling period.
+
+    Returns
+    -------
+    tuple
+        (starting_time, rate) if timestamps are uniform, None otherwise.
+    """
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    if timestamps.size < 2:
+        return None
+    period = (timestamps[-1] - timestamps[0]) / (timestamps.size - 1)
+    if period <= 0:
+        return None
+    reconstructed = timestamps[0] + np.arange(timestamps.size) * period
+    if np.max(np.abs(timestamps - reconstructed)) > tolerance * period:
+        return None
+    return float(timestamps[0]), float(1. / period)
+
+
+def series_timing(timestamps, tolerance=1e-3):
+    """
+    TimeSeries timing keyword arguments: starting_time and rate if timestamps are
+    uniform (see uniform_rate), explicit timestamps otherwise.
+    """
+    uniform = uniform_rate(timestamps, tolerance=tolerance)
+    if uniform is None:
+        return {'timestamps': timestamps}
+    return {'starting_time': uniform[0], 'rate': uniform[1]}
+
+
+def linked_timing(timing, series):
+    """
+    Timing keyword arguments of series sharing the timestamps of a first series:
+    explicit timestamps are replaced by a link to that series' timestamps.
+    """
+    if 'timestamps' in timing:
+        return {'timestamps': series}
+    return timing
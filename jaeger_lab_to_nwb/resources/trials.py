@@ -0,0 +1,72 @@
+from pynwb.epoch import TimeIntervals
+from hdmf.common import VectorData, VectorIndex
+
+import numpy as np
+
+
+def make_trials_table(start_time, stop_time, columns):
+    """
+    Builds a trials table with whole columns at once.
+
+    Parameters
+    ----------
+    start_time : array
+        Start time of each trial, in seconds.
+    stop_time : array
+        Stop time of each trial, in seconds.
+    columns : list
+        Dictionaries with the 'name', 'description' and 'data' of each extra column,
+        in table order. Ragged columns also have an 'index' entry: the end offset
+        of each trial's elements in the flat 'data'.
+
+    Returns
+    -------
+    TimeIntervals
+        Table to be set as nwbfile.trials.
+    """
+    table_columns = [
+        VectorData(name='start_time', description='Start time of epoch, in seconds', data=np.asarray(start_time)),
+        VectorData(name='stop_time', description='Stop time of epoch, in seconds', data=np.asarray(stop_time)),
+    ]
+    for col in columns:
+        vector_data = VectorData(name=col['name'], description=col['description'], data=col['data'])
+        table_columns.append(vector_data)
+        if col.get('index') is not None:
+            table_columns.append(VectorIndex(name=col['name'] + '_index', target=vector_data, data=col['index']))
+    return TimeIntervals(name='trials', description='experimental trials', columns=table_columns)
+
+
+def dataframe_to_columns(df, columns_spec):
+    """
+    Maps DataFrame columns to trials table columns, through a declarative spec.
+
+    Parameters
+    ----------
+    df : DataFrame
+        One row per trial.
+    columns_spec : list
+        Dictionaries with the 'source' column in df, the NWB column 'name', its
+        'dtype' (None keeps the DataFrame dtype) and 'description'.
+
+    Returns
+    -------
+    list
+        Column dictionaries for make_trials_table, with typed NumPy arrays as data.
+    """
+    columns = []
+    for spec in columns_spec:
+        data = df[spec['source']].to_numpy()
+        if spec.get('dtype') is not None:
+            data = data.astype(spec['dtype'])
+        columns.append({'name': spec['name'], 'description': spec['description'], 'data': data})
+    return columns
+
+
+def add_trials_from_dataframe(nwbfile, df, columns_spec, start_time, stop_time):
+    """Sets the trials table of nwbfile from a DataFrame, see dataframe_to_columns."""
+    nwbfile.trials = make_trials_table(
+        start_time=start_time,
+        stop_time=stop_time,
+        columns=dataframe_to_columns(df, columns_spec)
+    )
+    return nwbfile
@@ -20,6 +20,7 @@ setup(
         'matplotlib', 'cycler', 'scipy', 'numpy', 'jupyter', 'h5py', 'pynwb',
         'pyintan', 'nwbn-conversion-tools', 'ndx-fret'],
     entry_points={
-        'console_scripts': ['nwbn-gui-jaeger=jaeger_lab_to_nwb.gui_command_line:main'],
+        'console_scripts': ['nwbn-gui-jaeger=jaeger_lab_to_nwb.gui_command_line:main',
+                            'nwbn-batch-jaeger=jaeger_lab_to_nwb.batch_conversion:main'],
     }
 )
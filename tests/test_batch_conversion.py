@@ -0,0 +1,67 @@
+from jaeger_lab_to_nwb.batch_conversion import (read_manifest, make_job, limit_memory, restore_memory,
+                                                batch_conversion)
+
+import pandas as pd
+import pytest
+import yaml
+
+
+@pytest.fixture
+def batch_dir(tmp_path):
+    """Manifest of a complete session and of a session with missing source files."""
+    (tmp_path / 'out').mkdir()
+    (tmp_path / 'out' / 'done.nwb').write_bytes(b'complete')
+    with open(tmp_path / 'metafile.yml', 'w') as f:
+        yaml.safe_dump({'NWBFile': {'session_description': 'test', 'identifier': 'test'}}, f)
+    pd.DataFrame({
+        'output_file': [str(tmp_path / 'out' / 'done.nwb'), str(tmp_path / 'out' / 'missing.nwb')],
+        'dir_cortical_imaging': [str(tmp_path / 'done'), str(tmp_path / 'missing')],
+    }).to_csv(tmp_path / 'manifest.csv', index=False)
+    return tmp_path
+
+
+def test_read_manifest_yml(tmp_path):
+    with open(tmp_path / 'manifest.yml', 'w') as f:
+        yaml.safe_dump({'sessions': [{'output_file': 'a.nwb', 'dir_ecephys_rhd': 'rhd', 'add_rhd': 'false'}]}, f)
+    sessions = read_manifest(tmp_path / 'manifest.yml')
+    assert sessions == [{'output_file': 'a.nwb', 'dir_ecephys_rhd': 'rhd', 'add_rhd': 'false'}]
+
+    job = make_job(sessions[0], metadata={}, conversion_kwargs={'compression': 'lzf'})
+    assert job['source_paths'] == {'dir_ecephys_rhd': {'type': 'dir', 'path': 'rhd'}}
+    assert job['add_rhd'] is False
+    assert job['compression'] == 'lzf'
+    assert job['f_nwb'] == 'a.nwb'
+
+
+def test_read_manifest_missing_output_file(tmp_path):
+    pd.DataFrame({'output_file': ['a.nwb', ''], 'dir_ecephys_rhd': ['rhd', 'rhd']}).to_csv(
+        tmp_path / 'manifest.csv', index=False)
+    with pytest.raises(Exception):
+        read_manifest(tmp_path / 'manifest.csv')
+
+
+def test_batch_conversion_skips_complete_sessions(batch_dir):
+    results_file = batch_dir / 'results.csv'
+    for _ in range(2):
+        results = batch_conversion(batch_dir / 'manifest.csv', metafile=batch_dir / 'metafile.yml',
+                                   results_file=results_file)
+        assert [row['status'] for row in results] == ['skipped', 'failed']
+
+    # Skipped sessions are not written to the results table, failed sessions once per run
+    df = pd.read_csv(results_file)
+    assert list(df['output_file']) == [str(batch_dir / 'out' / 'missing.nwb')] * 2
+    assert list(df['status']) == ['failed', 'failed']
+    assert not (batch_dir / 'out' / 'missing.nwb').exists()
+    assert not (batch_dir / 'out' / 'missing.part.nwb').exists()
+
+
+def test_limit_memory_restore():
+    resource = pytest.importorskip('resource')
+    previous = resource.getrlimit(resource.RLIMIT_DATA)
+    assert limit_memory(None) is None
+
+    limits = limit_memory(1024)
+    assert limits == previous
+    assert resource.getrlimit(resource.RLIMIT_DATA)[0] != previous[0]
+    restore_memory(limits)
+    assert resource.getrlimit(resource.RLIMIT_DATA) == previous
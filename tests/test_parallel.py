@@ -0,0 +1,60 @@
+from jaeger_lab_to_nwb.resources.parallel import prefetch_map, PrefetchHub, parse_concurrently
+
+import multiprocessing
+import time
+
+
+def square(x, offset=0):
+    return x * x + offset
+
+
+def slow_square(x):
+    time.sleep(0.3)
+    return x * x
+
+
+def test_prefetch_map_order():
+    assert list(prefetch_map(square, range(10), n_workers=2, max_prefetch=3, offset=1)) == \
+        [x * x + 1 for x in range(10)]
+    assert multiprocessing.active_children() == []
+
+
+def test_prefetch_map_early_stop():
+    results = prefetch_map(slow_square, range(100), n_workers=1, max_prefetch=10)
+    assert next(results) == 0
+    assert len(multiprocessing.active_children()) > 0
+
+    # Closing the generator cancels the prefetched items not yet started (~3 s of work)
+    # and shuts down the pool
+    t0 = time.perf_counter()
+    results.close()
+    assert time.perf_counter() - t0 < 1.5
+    assert multiprocessing.active_children() == []
+
+
+def test_prefetch_map_consumer_exception():
+    results = prefetch_map(square, range(100), n_workers=2, max_prefetch=8)
+    try:
+        for result in results:
+            if result > 4:
+                raise RuntimeError('writer failed')
+    except RuntimeError:
+        pass
+    del results
+    assert multiprocessing.active_children() == []
+
+
+def test_prefetch_hub():
+    hub = PrefetchHub(func=square, items=list(range(5)), n_consumers=2, n_workers=2)
+    for index in range(5):
+        assert hub.get(index) == index * index
+        hub.release(index)
+        assert hub.get(index) == index * index
+        hub.release(index)
+    assert multiprocessing.active_children() == []
+
+
+def test_parse_concurrently():
+    parsers = {'a': (square, dict(x=2)), 'b': (square, dict(x=3, offset=1))}
+    assert parse_concurrently(parsers) == {'a': 4, 'b': 10}
+    assert parse_concurrently(dict()) == dict()
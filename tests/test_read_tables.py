@@ -0,0 +1,68 @@
+from jaeger_lab_to_nwb.resources import read_tables
+from jaeger_lab_to_nwb.resources.read_tables import read_table
+
+import pandas as pd
+import numpy as np
+import pytest
+
+# Tables: content, read_table kwargs
+TABLES = {
+    'header_trailing_delimiters': ('Trial\tStartT\tEndT\t\n1\t0.5\t2.5\t\n2\t3.0\t5.5\t\n', {'sep': '\t'}),
+    'data_trailing_delimiters': ('Trial\tStartT\tEndT\n1\t0.5\t2.5\t\n2\t3.0\t5.5\t\n', {'sep': '\t'}),
+    'no_header_trailing_delimiters': ('1\t0.5\t2.5\t\n2\t3.0\t5.5\t\n',
+                                      {'sep': '\t', 'names': ['Trial', 'StartT', 'EndT']}),
+    'no_trailing_delimiters': ('Trial,StartT,EndT\n1,0.5,2.5\n2,3.0,5.5\n', {'sep': ','}),
+}
+
+
+@pytest.fixture(params=['c', 'pyarrow'])
+def engine(request, monkeypatch):
+    """Runs a test with the C engine only, and with pyarrow if it is installed."""
+    if request.param == 'pyarrow':
+        pytest.importorskip('pyarrow')
+    else:
+        monkeypatch.setattr(read_tables, 'has_pyarrow', lambda: False)
+    return request.param
+
+
+@pytest.mark.parametrize('name', TABLES)
+def test_read_table_trailing_delimiters(tmp_path, engine, name):
+    content, kwargs = TABLES[name]
+    fpath = tmp_path / 'table.txt'
+    fpath.write_text(content)
+
+    read_kwargs = {'sep': kwargs['sep'], 'index_col': False}
+    if 'names' in kwargs:
+        read_kwargs.update({'header': None, 'names': kwargs['names']})
+    expected = pd.read_csv(fpath, **read_kwargs)
+    pd.testing.assert_frame_equal(read_table(str(fpath), **kwargs), expected)
+
+
+def test_read_table_dtypes(tmp_path, engine):
+    fpath = tmp_path / 'continuous.txt'
+    fpath.write_text('Time\tLick 1\tSpeed\tCount\n0.0\t1.0\t0.5\t1\n0.1\t0.0\t0.25\t2\n')
+
+    df = read_table(str(fpath), sep='\t', dtype={'Time': np.float64, 'Lick 1': np.int8}, float_dtype='float32')
+    assert df.dtypes.to_dict() == {'Time': np.float64, 'Lick 1': np.int8, 'Speed': np.float32, 'Count': np.int64}
+    np.testing.assert_array_equal(df['Lick 1'], [1, 0])
+
+
+def test_read_table_floats_past_sniffed_rows(tmp_path, engine):
+    fpath = tmp_path / 'late_floats.csv'
+    fpath.write_text('a,b\n' + ''.join('{},{}\n'.format(ii, ii) for ii in range(read_tables.SNIFF_ROWS)) + '1.5,2\n')
+
+    df = read_table(str(fpath), float_dtype='float32')
+    assert df.dtypes.to_dict() == {'a': np.float32, 'b': np.int64}
+    assert df['a'].iloc[-1] == 1.5
+
+
+def test_read_table_cache(tmp_path):
+    pytest.importorskip('pyarrow')
+    fpath = tmp_path / 'table.csv'
+    fpath.write_text('a,b\n1,0.5\n2,1.5\n')
+
+    df = read_table(str(fpath), float_dtype='float32')
+    assert list(tmp_path.glob('.*.feather')) == []
+    pd.testing.assert_frame_equal(read_table(str(fpath), float_dtype='float32', cache=True), df)
+    assert len(list(tmp_path.glob('.table.csv.*.feather'))) == 1
+    pd.testing.assert_frame_equal(read_table(str(fpath), float_dtype='float32', cache=True), df)
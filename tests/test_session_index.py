@@ -0,0 +1,35 @@
+from jaeger_lab_to_nwb.resources.session_index import find_valid_segments, join_file_segments, drop_short_segments
+
+import numpy as np
+
+
+def test_find_valid_segments():
+    valid = np.array([1, 1, 0, 1, 1, 1, 1, 0, 1], dtype=bool)
+    timestamps = np.array([0, 1, 2, 3, 4, 10, 11, 12, 13])
+    # Split at invalid samples and at the timestamp gap between samples 4 and 5
+    assert find_valid_segments(valid, timestamps) == [[0, 2, 0], [3, 5, 3], [5, 7, 10], [8, 9, 13]]
+    assert find_valid_segments([], []) == []
+
+
+def test_join_file_segments():
+    index = {'files': [{'n_samples': 10}, {'n_samples': 10}]}
+    # The last segment of the first file continues into the first one of the second file
+    file_segments = [[[0, 4, 0], [6, 10, 6]], [[0, 3, 10], [5, 10, 15]]]
+    joined = join_file_segments(index, file_segments)
+    assert [segment['n_samples'] for segment in joined] == [4, 7, 5]
+    assert joined[1] == {'first_timestamp': 6, 'n_samples': 7, 'pieces': [(0, 6, 10), (1, 0, 3)]}
+
+
+def test_drop_short_segments():
+    # Valid flag flickering between short runs, around two long runs
+    valid = np.zeros(1000, dtype=bool)
+    valid[0:300] = True
+    valid[301:699:2] = True
+    valid[700:1000] = True
+    file_segments = [find_valid_segments(valid, np.arange(1000))]
+    joined = join_file_segments({'files': [{'n_samples': 1000}]}, file_segments)
+    assert len(joined) == 201
+
+    kept = drop_short_segments(joined, min_samples=100)
+    assert [(segment['first_timestamp'], segment['n_samples']) for segment in kept] == [(0, 300), (700, 300)]
+    assert drop_short_segments(joined, min_samples=0) == joined
@@ -0,0 +1,60 @@
+from jaeger_lab_to_nwb.resources.create_nwbfile import create_nwbfile, matches_session_start_time
+from jaeger_lab_to_nwb.resources.add_behavior import (attach_behavior_bpod, attach_behavior_treadmill,
+                                                      attach_behavior_labview)
+from jaeger_lab_to_nwb.resources.add_ecephys import attach_ecephys_rhd
+from jaeger_lab_to_nwb.resources.add_ophys import attach_ophys_rsd
+
+from datetime import datetime, timedelta, timezone
+from pynwb import NWBHDF5IO
+import pytest
+
+SESSION_START_TIME = datetime(2020, 3, 1, 10, 0, 0)
+OTHER_START_TIME = SESSION_START_TIME + timedelta(days=1)
+
+METADATA = {'NWBFile': {'session_description': 'test', 'identifier': 'test'}}
+
+# Attach phases, with the parts of their parsed data read before the start time check
+ATTACH = {
+    'bpod': (attach_behavior_bpod, lambda start: {'session': {'session_start_datetime': start}}),
+    'rhd': (attach_ecephys_rhd, lambda start: {'parsed': {
+        'index': {'header': {'sample_rate': 20000., 'amplifier_channels': [], 'notch_filter_frequency': 0}},
+        'all_files': [], 'session_start_time': start}}),
+    'treadmill': (attach_behavior_treadmill, lambda start: {'parsed': {'session_start_time': start}}),
+    'labview': (attach_behavior_labview, lambda start: {'parsed': {'session_start_time': start, 't0': 0.}}),
+    'ophys': (attach_ophys_rsd, lambda start: {'parsed': {'source_dir': '', 'index': {},
+                                                          'session_start_time': start}}),
+}
+
+
+@pytest.fixture
+def existing_nwbfile(tmp_path):
+    """Path to a nwb file started at SESSION_START_TIME, as written by a first conversion."""
+    f_nwb = str(tmp_path / 'existing.nwb')
+    metadata = {'NWBFile': dict(METADATA['NWBFile'], session_start_time=SESSION_START_TIME)}
+    with NWBHDF5IO(f_nwb, mode='w') as io:
+        io.write(create_nwbfile(metadata))
+    return f_nwb
+
+
+def test_matches_session_start_time(existing_nwbfile):
+    with NWBHDF5IO(existing_nwbfile, mode='r') as io:
+        nwbfile = io.read()
+        # Naive start times from source files, against the timezone-aware start time read back
+        assert nwbfile.session_start_time.tzinfo is not None
+        assert matches_session_start_time(nwbfile, SESSION_START_TIME)
+        assert not matches_session_start_time(nwbfile, OTHER_START_TIME)
+        assert matches_session_start_time(nwbfile, nwbfile.session_start_time)
+        assert not matches_session_start_time(nwbfile, nwbfile.session_start_time.astimezone(timezone.utc) +
+                                              timedelta(hours=1))
+
+
+@pytest.mark.parametrize('modality', ATTACH)
+def test_attach_aborts_on_other_start_time(existing_nwbfile, modality, capsys):
+    attach, parsed = ATTACH[modality]
+    with NWBHDF5IO(existing_nwbfile, mode='a') as io:
+        nwbfile = io.read()
+        assert attach(nwbfile=nwbfile, metadata=METADATA, **parsed(OTHER_START_TIME)) is nwbfile
+        assert len(nwbfile.acquisition) == 0
+        assert len(nwbfile.devices) == 0
+        assert nwbfile.trials is None
+    assert 'does not match' in capsys.readouterr().out